@@ -0,0 +1,113 @@
+"""
+响应序列化基准：比较历史记录页在不同 JSON 后端下的编码耗时与响应体大小
+
+用法：
+    python benchmarks/bench_response.py [--pages 10 50] [--repeat 2000] [--json]
+
+对比项：
+    legacy      原实现：json.dumps 默认参数（中文转义为 \\uXXXX），datetime 先 strftime
+    json-utf8   标准库 json，UTF-8 输出，紧凑分隔符
+    orjson      orjson（未安装时跳过）
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wxcloudrun.response import _default, DATETIME_FORMAT  # noqa: E402
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+READING_CONTENT = (
+    "让我们来看看你近期的事业走向。时间之流三牌阵分别代表过去、现在与未来。\n"
+    "愚者牌正位：画面中的少年站在悬崖边，背着轻便的行囊，眼神望向远方。它象征着你过去敢于从零开始的勇气，"
+    "那份不怕犯错的轻盈感，正是你一路走来的底色。\n"
+    "女祭司牌逆位：月光下的女祭司本该安静地守护秘密，逆位时却显得心神不宁。这提示你当下有些忽视了内心声音，"
+    "忙碌让你很难停下来倾听自己真正想要什么。\n"
+    "命运之轮牌正位：转动的轮盘意味着转机正在靠近。未来的变化并不完全由你掌控，但你可以选择以怎样的姿态迎接它。"
+) * 2
+ANALYSIS = "三张牌连成一条清晰的情绪流动：从无畏出发，到暂时迷失方向，再到迎来新的转机。" * 4
+QUOTE = "每一次停下来倾听自己，都是为了走得更远。"
+ADVICE = "1. 每晚写下三件让你感到踏实的小事。\n2. 本周尝试一次与信任的前辈对话。\n3. 给自己留出半天不被打扰的独处时间。"
+
+
+def build_history_page(size):
+    base = datetime(2026, 2, 18, 14, 30)
+    records = []
+    for i in range(size):
+        records.append({
+            'id': 1000 + i,
+            'question': '我今年的事业发展如何？',
+            'cards': {'愚者': '正', '女祭司': '负', '命运之轮': '正'},
+            'spread': '时间之流三牌阵',
+            'status': 'completed',
+            'result': {'reading_content': READING_CONTENT, '综合分析': ANALYSIS, '金句': QUOTE, '建议': ADVICE},
+            'created_at': base - timedelta(hours=i),
+        })
+    return {'code': 0, 'data': {'list': records, 'next_cursor': 'eyJhIjoxfQ', 'has_more': True, 'page_size': size}}
+
+
+def encode_legacy(doc):
+    """原实现：视图中逐条 strftime，再用 json.dumps 默认参数（中文转义）"""
+    data = dict(doc['data'])
+    data['list'] = [dict(r, created_at=r['created_at'].strftime(DATETIME_FORMAT)) for r in data['list']]
+    return json.dumps({'code': doc['code'], 'data': data}).encode('ascii')
+
+
+def encode_json_utf8(doc):
+    return json.dumps(doc, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+def encode_orjson(doc):
+    return orjson.dumps(doc, default=_default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+
+
+def _bench(fn, doc, repeat):
+    fn(doc)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(doc)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, nargs='+', default=[10, 50], help='每页记录数')
+    parser.add_argument('--repeat', type=int, default=2000, help='每项重复次数')
+    parser.add_argument('--json', action='store_true', help='输出机器可读的 JSON')
+    args = parser.parse_args()
+
+    backends = [('legacy', encode_legacy), ('json-utf8', encode_json_utf8)]
+    if orjson is not None:
+        backends.append(('orjson', encode_orjson))
+
+    results = []
+    for size in args.pages:
+        doc = build_history_page(size)
+        for name, fn in backends:
+            seconds = _bench(fn, doc, args.repeat)
+            results.append({
+                'backend': name,
+                'page_size': size,
+                'bytes': len(fn(doc)),
+                'encode_us': round(seconds * 1e6, 1),
+            })
+
+    if args.json:
+        print(json.dumps({'benchmark': 'response', 'results': results}, indent=2))
+        return
+
+    print('{:<10} {:>9} {:>10} {:>12}'.format('backend', 'page_size', 'bytes', 'encode_us'))
+    for row in results:
+        print('{backend:<10} {page_size:>9} {bytes:>10} {encode_us:>12}'.format(**row))
+
+
+if __name__ == '__main__':
+    main()
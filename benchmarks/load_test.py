@@ -0,0 +1,384 @@
+"""
+端到端负载测试：在本进程内启动应用（SQLite 或本地 MySQL）和模拟 DeepSeek 服务，
+用多个虚拟用户按真实流程发请求，输出 JSON 格式的结果，便于比较不同版本
+
+用法：
+    python benchmarks/load_test.py [--database-url sqlite:////tmp/tarot_bench.db] [--users 20] [--readings 3]
+                                   [--latency 2.0] [--jitter 0.5] [--error-rate 0] [--stream]
+                                   [--poll-wait 0] [--poll-interval 0.5]
+                                   [--output result.json] [--baseline old.json] [--tolerance 0.2]
+
+每个虚拟用户依次：
+    POST /api/tarot 提交解读 → 轮询 GET /api/tarot/result 直到完成（--poll-wait>0 时使用长轮询）
+    → 翻两页 GET /api/tarot/history → GET /api/tarot/image + POST /api/tarot/images
+全部用户结束后，再单独测一轮“进行中的解读”占用的内存（tracemalloc）
+
+输出指标：
+    submit_to_complete_ms    提交到解读完成的耗时分位数（客户端观测）
+    poll_qps / polls_per_reading
+    routes                   各接口的请求数、耗时分位数、每次请求的数据库查询数
+    background_queries_per_reading  后台解读线程每条解读执行的数据库查询数
+    memory_per_inflight_kb   每个进行中的解读占用的内存
+    prompt_cache_hit_ratio / max_tokens_per_call  模拟服务统计的前缀缓存命中率与请求的 max_tokens
+
+--baseline 指定上一版本的输出文件时，耗时、查询数、内存超过基线 (1 + tolerance) 倍即视为回归，退出码为 1
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import requests  # noqa: E402
+
+from mock_deepseek import MockSettings, start as start_mock  # noqa: E402
+
+CARD_NAMES = ['0愚者', '1魔术师', '2女祭司', '3皇后', '4皇帝', '10命运之轮', '17星星', '19太阳']
+CARDS = {'愚者': '正', '女祭司': '负', '命运之轮': '正'}
+SPREAD = '时间之流三牌阵'
+POSITIONS = ['过去', '现在', '未来']
+
+
+def percentiles(values):
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+
+    return {
+        'count': len(ordered),
+        'mean': round(sum(ordered) / len(ordered), 2),
+        'p50': pick(0.50),
+        'p90': pick(0.90),
+        'p99': pick(0.99),
+        'max': round(ordered[-1], 2),
+    }
+
+
+def git_version():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def configure_environment(args, mock_url):
+    """导入应用前设置环境变量（config.py 在导入时读取）"""
+    manifest = os.path.join(tempfile.mkdtemp(prefix='tarot_bench_'), 'card_manifest.json')
+    with open(manifest, 'w', encoding='utf-8') as f:
+        json.dump([name + '.png' for name in CARD_NAMES], f, ensure_ascii=False)
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ['DEEPSEEK_API_KEY'] = 'bench'
+    os.environ['DEEPSEEK_API_URL'] = mock_url
+    # 两个开关都会让上游调用走流式，必须一起设置，否则 --stream 不改变被测的调用方式
+    os.environ['DEEPSEEK_STREAM'] = '1' if args.stream else '0'
+    os.environ['PARTIAL_RESULTS'] = '1' if args.stream else '0'
+    os.environ['STORAGE_BASE_URL'] = mock_url.rsplit('/', 1)[0]
+    os.environ['STORAGE_MANIFEST_FILE'] = manifest
+    # 以下默认值可通过环境变量覆盖，用于测试限流、缓存等配置的影响
+    os.environ.setdefault('LLM_RATE_LIMIT', '0')
+    os.environ.setdefault('LLM_MAX_PENDING_PER_USER', '0')
+    os.environ.setdefault('READING_CACHE_ENABLED', '0')
+    os.environ.setdefault('RECOVERY_INTERVAL', '0')
+
+
+class QueryCounter(object):
+    """按请求路由统计数据库查询数；不在请求中的查询（后台解读线程）计入 background"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.queries = defaultdict(int)
+        self.requests = defaultdict(int)
+
+    def install(self, app, engine):
+        from flask import request
+        from sqlalchemy import event
+
+        @app.before_request
+        def _bench_begin():
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            self._local.route = route
+            with self._lock:
+                self.requests[route] += 1
+
+        @app.teardown_request
+        def _bench_end(exc=None):
+            self._local.route = None
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def _count(conn, cursor, statement, parameters, context, executemany):
+            route = getattr(self._local, 'route', None) or 'background'
+            with self._lock:
+                self.queries[route] += 1
+
+
+class Recorder(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = defaultdict(list)
+        self.completion = []
+        self.polls = 0
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(int)
+
+    def record(self, route, elapsed, ok=True):
+        with self._lock:
+            self.latency[route].append(elapsed * 1000)
+            if not ok:
+                self.errors[route] += 1
+
+
+def timed(recorder, route, fn, *args, **kwargs):
+    start = time.perf_counter()
+    try:
+        resp = fn(*args, **kwargs)
+    except requests.RequestException:
+        recorder.record(route, time.perf_counter() - start, ok=False)
+        return None
+    recorder.record(route, time.perf_counter() - start, ok=resp.status_code == 200)
+    return resp
+
+
+def virtual_user(base, index, args, recorder):
+    session = requests.Session()
+    session.headers['X-WX-OPENID'] = 'bench-user-{}'.format(index)
+    for n in range(args.readings):
+        submitted = time.perf_counter()
+        resp = timed(recorder, '/api/tarot', session.post, base + '/api/tarot', json={
+            'question': '基准测试问题 {}-{}：我近期的事业发展如何？'.format(index, n),
+            'cards': CARDS, 'spread': SPREAD, 'positions': POSITIONS,
+        })
+        body = resp.json() if resp is not None else {}
+        reading_id = body.get('reading_id')
+        if not reading_id:
+            with recorder._lock:
+                recorder.statuses['submit_rejected'] += 1
+            continue
+        status = None
+        deadline = time.monotonic() + args.poll_timeout
+        while time.monotonic() < deadline:
+            params = {'id': reading_id}
+            if args.poll_wait:
+                params['wait'] = args.poll_wait
+            resp = timed(recorder, '/api/tarot/result', session.get, base + '/api/tarot/result', params=params)
+            with recorder._lock:
+                recorder.polls += 1
+            status = resp.json().get('status') if resp is not None else None
+            if status in ('completed', 'failed'):
+                break
+            if not args.poll_wait:
+                time.sleep(args.poll_interval)
+        with recorder._lock:
+            recorder.statuses[status or 'timeout'] += 1
+            if status == 'completed':
+                recorder.completion.append((time.perf_counter() - submitted) * 1000)
+
+    resp = timed(recorder, '/api/tarot/history', session.get, base + '/api/tarot/history',
+                 params={'cursor': '', 'page_size': 2, 'view': 'summary'})
+    cursor = resp.json().get('data', {}).get('next_cursor') if resp is not None else None
+    if cursor:
+        timed(recorder, '/api/tarot/history', session.get, base + '/api/tarot/history',
+              params={'cursor': cursor, 'page_size': 2, 'view': 'summary'})
+    timed(recorder, '/api/tarot/image', session.get, base + '/api/tarot/image',
+          params={'name': CARD_NAMES[index % len(CARD_NAMES)]})
+    timed(recorder, '/api/tarot/images', session.post, base + '/api/tarot/images', json={'names': CARD_NAMES})
+
+
+def measure_inflight_memory(base, settings, workers, hold_latency):
+    """在解读全部处于调用大模型阶段时，测量每个进行中的解读占用的内存"""
+    settings.latency, settings.jitter = hold_latency, 0.0
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    ids = []
+    for i in range(workers):
+        resp = requests.post(base + '/api/tarot', headers={'X-WX-OPENID': 'bench-mem-{}'.format(i)}, json={
+            'question': '内存测试 {}'.format(i), 'cards': CARDS, 'spread': SPREAD, 'positions': POSITIONS,
+        })
+        ids.append((i, resp.json().get('reading_id')))
+    deadline = time.monotonic() + hold_latency
+    while settings.stats()['active'] < workers and time.monotonic() < deadline:
+        time.sleep(0.01)
+    gc.collect()
+    during = tracemalloc.get_traced_memory()[0]
+    inflight = settings.stats()['active']
+    tracemalloc.stop()
+    for i, reading_id in ids:
+        if reading_id:
+            requests.get(base + '/api/tarot/result', headers={'X-WX-OPENID': 'bench-mem-{}'.format(i)},
+                         params={'id': reading_id, 'wait': hold_latency + 5})
+    if not inflight:
+        return None, 0
+    return round((during - before) / 1024.0 / inflight, 1), inflight
+
+
+def compare(result, baseline, tolerance):
+    """耗时、查询数、内存超过基线 (1 + tolerance) 倍的指标"""
+    checks = [('submit_to_complete_ms.p50', lambda r: r['submit_to_complete_ms'].get('p50')),
+              ('submit_to_complete_ms.p99', lambda r: r['submit_to_complete_ms'].get('p99')),
+              ('memory_per_inflight_kb', lambda r: r.get('memory_per_inflight_kb')),
+              ('background_queries_per_reading', lambda r: r.get('background_queries_per_reading'))]
+    for route in result['routes']:
+        checks.append(('routes.{}.p99_ms'.format(route),
+                       lambda r, route=route: r['routes'].get(route, {}).get('p99_ms')))
+        checks.append(('routes.{}.db_queries_per_request'.format(route),
+                       lambda r, route=route: r['routes'].get(route, {}).get('db_queries_per_request')))
+    regressions = []
+    for name, getter in checks:
+        try:
+            new, old = getter(result), getter(baseline)
+        except (KeyError, AttributeError):
+            continue
+        if new is None or not old:
+            continue
+        if new > old * (1 + tolerance):
+            regressions.append({'metric': name, 'baseline': old, 'current': new, 'ratio': round(new / old, 3)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default='sqlite:///' + os.path.join(tempfile.gettempdir(), 'tarot_bench.db'))
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--readings', type=int, default=3, help='每个虚拟用户提交的解读数')
+    parser.add_argument('--latency', type=float, default=2.0, help='模拟 DeepSeek 的平均响应延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--stream', action='store_true',
+                        help='以流式模式调用模拟 DeepSeek（同时开启 SSE 缓冲区和部分结果）；不传时两者都关闭')
+    parser.add_argument('--poll-wait', type=float, default=0, help='长轮询等待秒数，0 表示短轮询')
+    parser.add_argument('--poll-interval', type=float, default=0.5, help='短轮询间隔（秒）')
+    parser.add_argument('--poll-timeout', type=float, default=120)
+    parser.add_argument('--memory-latency', type=float, default=3.0, help='内存测量阶段的模拟延迟（秒）')
+    parser.add_argument('--output', help='结果写入文件（默认输出到标准输出）')
+    parser.add_argument('--baseline', help='上一版本的结果文件，用于回归比较')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    settings = MockSettings(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    mock_server, mock_url = start_mock(settings)
+    if args.database_url.startswith('sqlite:///'):
+        path = args.database_url[len('sqlite:///'):]
+        if os.path.exists(path):
+            os.remove(path)
+    configure_environment(args, mock_url)
+
+    import config
+    from werkzeug.serving import make_server
+    from wxcloudrun import app, db
+    from wxcloudrun.bootstrap import bootstrap
+
+    bootstrap()
+    if db.engine.dialect.name == 'sqlite':
+        from sqlalchemy import event
+
+        @event.listens_for(db.engine, 'connect')
+        def _sqlite_wal(dbapi_connection, connection_record):
+            dbapi_connection.execute('PRAGMA journal_mode=WAL')
+
+    counter = QueryCounter()
+    counter.install(app, db.engine)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-server', daemon=True).start()
+    base = 'http://127.0.0.1:{}'.format(server.server_port)
+    requests.get(base + '/api/ready')
+
+    recorder = Recorder()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as executor:
+        futures = [executor.submit(virtual_user, base, i, args, recorder) for i in range(args.users)]
+        for future in futures:
+            future.result()
+    duration = time.perf_counter() - started
+    mock_stats = settings.stats()
+
+    background_queries = counter.queries.get('background', 0)
+    memory_kb, inflight = measure_inflight_memory(base, settings, config.READING_WORKERS, args.memory_latency)
+
+    routes = {}
+    for route, values in sorted(recorder.latency.items()):
+        stats = percentiles(values)
+        served = counter.requests.get(route, 0)
+        routes[route] = {
+            'requests': stats['count'],
+            'errors': recorder.errors.get(route, 0),
+            'p50_ms': stats.get('p50'),
+            'p90_ms': stats.get('p90'),
+            'p99_ms': stats.get('p99'),
+            'db_queries_per_request': round(counter.queries.get(route, 0) / float(served), 2) if served else None,
+        }
+    completed = recorder.statuses.get('completed', 0)
+    result = {
+        'version': git_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'settings': {
+            'database': db.engine.dialect.name,
+            'users': args.users,
+            'readings_per_user': args.readings,
+            'stream': config.DEEPSEEK_STREAM,
+            'partial_results': config.PARTIAL_RESULTS,
+            'poll_wait': args.poll_wait,
+            'poll_interval': args.poll_interval,
+            'mock_latency': args.latency,
+            'mock_jitter': args.jitter,
+            'mock_error_rate': args.error_rate,
+            'reading_workers': config.READING_WORKERS,
+            'reading_queue_size': config.READING_QUEUE_SIZE,
+        },
+        'duration_s': round(duration, 2),
+        'readings': dict(recorder.statuses),
+        'readings_per_s': round(completed / duration, 2) if duration else None,
+        'submit_to_complete_ms': percentiles(recorder.completion),
+        'poll_qps': round(recorder.polls / duration, 2) if duration else None,
+        'polls_per_reading': round(recorder.polls / float(completed), 2) if completed else None,
+        'routes': routes,
+        'background_queries_per_reading': round(background_queries / float(completed), 2) if completed else None,
+        'memory_per_inflight_kb': memory_kb,
+        'memory_inflight_readings': inflight,
+        'deepseek_calls': mock_stats['calls'],
+        'deepseek_errors': mock_stats['errors'],
+        'prompt_tokens_per_call': round(mock_stats['prompt_tokens'] / float(mock_stats['calls']), 1)
+        if mock_stats['calls'] else None,
+        'prompt_cache_hit_ratio': round(mock_stats['cache_hit_tokens'] / float(mock_stats['prompt_tokens']), 3)
+        if mock_stats['prompt_tokens'] else None,
+        'max_tokens_per_call': round(mock_stats['max_tokens_total'] / float(mock_stats['calls']), 1)
+        if mock_stats['calls'] else None,
+    }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            result['regressions'] = compare(result, json.load(f), args.tolerance)
+        exit_code = 1 if result['regressions'] else 0
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    server.shutdown()
+    mock_server.shutdown()
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
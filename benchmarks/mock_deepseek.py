@@ -0,0 +1,205 @@
+"""
+本地 DeepSeek chat-completions 模拟服务，供基准测试使用
+
+用法：
+    python benchmarks/mock_deepseek.py [--port 18999] [--latency 2.0] [--jitter 0.5]
+                                       [--error-rate 0.02] [--chunk-delay 0.02]
+
+- POST 任意路径：按 OpenAI 兼容格式返回一段结构完整的塔罗解读 JSON，stream=true 时按 SSE 分块返回
+- latency/jitter：每次调用的响应延迟（秒，均匀抖动）；流式模式下为首包延迟
+- error-rate：按比例返回 429/503（会触发客户端重试）
+- usage 按消息长度估算 prompt token，并模拟前缀缓存：与之前请求相同的前缀（按 64 token 为单位）计为 prompt_cache_hit_tokens
+- HEAD 任意路径返回 200（图片存在性探测），GET 返回 404（对象存储列目录不可用）
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+READING = {
+    "reading_content": (
+        "愚者牌正位：画面中的少年站在悬崖边，背着轻便的行囊，眼神望向远方。它象征着你敢于从零开始的勇气。\n"
+        "女祭司牌逆位：月光下的女祭司本该安静地守护秘密，逆位时却显得心神不宁，提示你有些忽视了内心的声音。\n"
+        "命运之轮牌正位：转动的轮盘意味着转机正在靠近，你可以选择以怎样的姿态迎接它。"
+    ) * 2,
+    "综合分析": "三张牌连成一条清晰的情绪流动：从无畏出发，到暂时迷失方向，再到迎来新的转机。" * 3,
+    "金句": "每一次停下来倾听自己，都是为了走得更远。",
+    "建议": "1. 每晚写下三件让你感到踏实的小事。\n2. 本周尝试一次与信任的前辈对话。\n3. 给自己留出半天独处时间。",
+}
+
+
+class MockSettings(object):
+    """运行时可调整的模拟参数（基准测试在不同阶段修改）"""
+
+    def __init__(self, latency=2.0, jitter=0.5, error_rate=0.0, chunk_size=8, chunk_delay=0.02,
+                 prompt_tokens=900, completion_tokens=700):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.content = json.dumps(READING, ensure_ascii=False)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.active = 0
+        self.prompt_tokens_total = 0
+        self.cache_hit_tokens = 0
+        self.max_tokens_total = 0
+        self._prefixes = set()
+
+    def delay(self):
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def begin(self):
+        with self._lock:
+            self.calls += 1
+            self.active += 1
+
+    def end(self):
+        with self._lock:
+            self.active -= 1
+
+    def prompt_usage(self, body):
+        """
+        估算 prompt token（中文约 0.6 token/字），并按 64 token 块模拟前缀缓存命中
+        :return: (prompt_tokens, cache_hit_tokens)
+        """
+        text = ''.join(m.get('content', '') for m in body.get('messages') or [])
+        chars_per_block = int(64 / 0.6)
+        prompt_tokens = int(len(text) * 0.6) or self.prompt_tokens
+        hit_blocks = 0
+        with self._lock:
+            for end in range(chars_per_block, len(text) + 1, chars_per_block):
+                prefix = hash(text[:end])
+                if prefix in self._prefixes:
+                    hit_blocks += 1
+                else:
+                    self._prefixes.add(prefix)
+            hit = min(prompt_tokens, hit_blocks * 64)
+            self.prompt_tokens_total += prompt_tokens
+            self.cache_hit_tokens += hit
+            self.max_tokens_total += body.get('max_tokens') or 0
+        return prompt_tokens, hit
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'errors': self.errors,
+                'active': self.active,
+                'prompt_tokens': self.prompt_tokens_total,
+                'cache_hit_tokens': self.cache_hit_tokens,
+                'max_tokens_total': self.max_tokens_total,
+            }
+
+
+def make_handler(settings):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _empty(self, status):
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def do_HEAD(self):
+            self._empty(200)
+
+        def do_GET(self):
+            self._empty(404)
+
+        def _chunk(self, data):
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+            self.wfile.flush()
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+            settings.begin()
+            try:
+                time.sleep(settings.delay())
+                if settings.error_rate and random.random() < settings.error_rate:
+                    with settings._lock:
+                        settings.errors += 1
+                    self._empty(random.choice((429, 503)))
+                    return
+                prompt_tokens, hit = settings.prompt_usage(body)
+                usage = {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': settings.completion_tokens,
+                    'total_tokens': prompt_tokens + settings.completion_tokens,
+                    'prompt_cache_hit_tokens': hit,
+                    'prompt_cache_miss_tokens': prompt_tokens - hit,
+                }
+                content = settings.content
+                if body.get('stream'):
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/event-stream')
+                    self.send_header('Transfer-Encoding', 'chunked')
+                    self.end_headers()
+                    for i in range(0, len(content), settings.chunk_size):
+                        piece = {'choices': [{'delta': {'content': content[i:i + settings.chunk_size]}}]}
+                        self._chunk(('data: ' + json.dumps(piece, ensure_ascii=False) + '\n\n').encode('utf-8'))
+                        if settings.chunk_delay:
+                            time.sleep(settings.chunk_delay)
+                    last = {'choices': [{'delta': {}, 'finish_reason': 'stop'}], 'usage': usage}
+                    self._chunk(('data: ' + json.dumps(last) + '\n\n').encode('utf-8'))
+                    self._chunk(b'data: [DONE]\n\n')
+                    self._chunk(b'')
+                    return
+                out = json.dumps({'choices': [{'message': {'content': content}}], 'usage': usage},
+                                 ensure_ascii=False).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+            finally:
+                settings.end()
+
+    return Handler
+
+
+def start(settings, host='127.0.0.1', port=0):
+    """
+    在后台线程启动模拟服务
+    :return: (server, base_url)
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(settings))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='mock-deepseek')
+    thread.daemon = True
+    thread.start()
+    return server, 'http://{}:{}/chat/completions'.format(host, server.server_address[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18999)
+    parser.add_argument('--latency', type=float, default=2.0)
+    parser.add_argument('--jitter', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--chunk-delay', type=float, default=0.02)
+    args = parser.parse_args()
+    settings = MockSettings(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                            chunk_delay=args.chunk_delay)
+    server, url = start(settings, args.host, args.port)
+    print("mock DeepSeek listening on {}".format(url))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# gunicorn 生产环境配置
+# 启动命令：gunicorn -c gunicorn.conf.py wxcloudrun:app
+# 注意：gunicorn 会把本文件的模块级变量当作配置项，项目配置不能命名为 config
+import signal
+
+import config as app_config
+
+bind = '0.0.0.0:{}'.format(app_config.SERVER_PORT)
+workers = app_config.SERVER_WORKERS
+threads = app_config.SERVER_THREADS
+worker_class = 'gthread'
+
+# 在主进程中完成导入后再 fork 工作进程（数据库连接、DeepSeek 会话、线程池均在子进程中按需创建）
+preload_app = True
+
+# gthread 模式下 timeout 是工作进程心跳超时，不限制单个请求（SSE、长轮询）的时长
+timeout = 60
+keepalive = 5
+
+# SIGTERM 后留给工作进程的时间：解读任务的排空在收到 SIGTERM 时立即开始（见 post_worker_init），
+# 与关闭进行中的请求（SSE、长轮询）同时进行，须在到期被 SIGKILL 之前完成
+graceful_timeout = int(app_config.SHUTDOWN_GRACE_PERIOD) + 10
+
+accesslog = '-'
+errorlog = '-'
+
+
+def when_ready(server):
+    """主进程 fork 工作进程之前：结构版本不一致时执行迁移"""
+    from wxcloudrun.bootstrap import bootstrap
+    try:
+        bootstrap()
+    except Exception as e:
+        server.log.error("启动迁移失败: {}".format(e))
+
+
+def post_worker_init(worker):
+    """
+    工作进程开始接收请求之前：预热连接并恢复 pending 任务，不让第一个请求承担建连耗时
+    并接管 SIGTERM：gthread 工作进程要等进行中的请求结束（最长到 graceful_timeout）才调用 worker_exit，
+    此时主进程的 SIGKILL 也已到期，因此排空解读任务须在收到信号时就开始
+    """
+    from wxcloudrun.views import init_worker, start_drain
+    try:
+        init_worker()
+    except Exception as e:
+        worker.log.error("启动初始化失败: {}".format(e))
+
+    handle_exit = worker.handle_exit
+
+    def on_sigterm(sig, frame):
+        start_drain()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+
+def worker_exit(server, worker):
+    """工作进程退出前确认解读任务已排空（通常已在收到 SIGTERM 时开始），超时的任务退回 pending"""
+    from wxcloudrun.views import drain_readings
+    drain_readings(app_config.SHUTDOWN_GRACE_PERIOD)
@@ -3,6 +3,17 @@ import sys
 
 from wxcloudrun import app
 
-# 启动Flask Web服务
+# 启动Flask Web服务（开发服务器，仅用于本地调试；生产环境见 gunicorn.conf.py）
+# python run.py migrate：部署时执行数据库结构迁移
+# python run.py archive：执行一轮解读记录归档（可由定时任务调用）
 if __name__ == '__main__':
-    app.run(host=sys.argv[1], port=sys.argv[2])
+    if sys.argv[1:2] == ['migrate']:
+        from wxcloudrun.migrate import migrate
+        print("迁移完成, version={}".format(migrate()))
+    elif sys.argv[1:2] == ['archive']:
+        from wxcloudrun.archive import archive_once
+        print("归档完成, {}".format(archive_once()))
+    else:
+        from wxcloudrun.bootstrap import bootstrap
+        bootstrap()
+        app.run(host=sys.argv[1], port=sys.argv[2])
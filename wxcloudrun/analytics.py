@@ -0,0 +1,289 @@
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from flask import has_app_context
+from sqlalchemy import and_, func, insert, update
+from sqlalchemy.dialects import mysql, sqlite
+
+import config
+from wxcloudrun import app, db
+from wxcloudrun.model import TarotReading, TarotReadingArchive, AnalyticsDaily, AnalyticsDailySpread, \
+    AnalyticsDailyUser, china_now
+
+logger = logging.getLogger('log')
+
+# 汇总表中的计数列（与解读状态同名）
+COUNT_FIELDS = ('submitted', 'completed', 'failed')
+
+
+def _upsert_increment(model, keys, deltas):
+    """
+    把 deltas 中的各计数列累加到主键为 keys 的汇总行，行不存在时插入
+    MySQL 使用 INSERT ... ON DUPLICATE KEY UPDATE col = col + n，单条语句完成
+    """
+    table = model.__table__
+    values = dict(keys)
+    values.update(deltas)
+    increments = {field: table.c[field] + n for field, n in deltas.items()}
+    dialect = db.engine.dialect.name
+    if dialect == 'mysql':
+        stmt = mysql.insert(table).values(**values).on_duplicate_key_update(**increments)
+    elif dialect == 'sqlite':
+        stmt = sqlite.insert(table).values(**values).on_conflict_do_update(
+            index_elements=list(keys), set_=increments
+        )
+    else:
+        where = and_(*[table.c[k] == v for k, v in keys.items()])
+        if db.session.execute(update(table).where(where).values(**increments)).rowcount == 0:
+            db.session.execute(insert(table).values(**values))
+        return
+    db.session.execute(stmt)
+
+
+def _insert_ignore(model, values):
+    """插入一行，主键已存在时忽略；:return: 是否插入了新行"""
+    stmt = insert(model.__table__).values(**values)
+    dialect = db.engine.dialect.name
+    if dialect == 'mysql':
+        stmt = stmt.prefix_with('IGNORE')
+    elif dialect == 'sqlite':
+        stmt = stmt.prefix_with('OR IGNORE')
+    else:
+        if db.session.get(model, tuple(values.values())) is not None:
+            return False
+    return db.session.execute(stmt).rowcount == 1
+
+
+class AnalyticsRecorder(object):
+    """
+    统计汇总的增量记录器
+    请求路径和解读线程只在内存中累加增量，由后台线程每 flush_interval 秒合并写入汇总表（一个短事务）
+    写入失败时增量放回内存，下次重试；进程被强制杀死时最多丢失一个间隔内的增量
+    """
+
+    def __init__(self, flush_interval=10):
+        self.flush_interval = float(flush_interval)
+        self._lock = threading.Lock()
+        # (day, spread) -> {field: n}
+        self._counts = defaultdict(lambda: defaultdict(int))
+        # (day, openid)
+        self._users = set()
+        self._stop = threading.Event()
+        self._pid = None
+        self.flushes = 0
+        self.errors = 0
+
+    @classmethod
+    def from_config(cls):
+        return cls(config.ANALYTICS_FLUSH_INTERVAL)
+
+    def record_submitted(self, openid, spread):
+        """新建了一条解读记录"""
+        day = china_now().date()
+        with self._lock:
+            self._counts[(day, spread)]['submitted'] += 1
+            self._users.add((day, openid))
+        if self.flush_interval <= 0:
+            self.flush()
+
+    def record_finished(self, spread, status):
+        """解读结束（completed / failed）"""
+        if status not in COUNT_FIELDS:
+            return
+        day = china_now().date()
+        with self._lock:
+            self._counts[(day, spread)][status] += 1
+        if self.flush_interval <= 0:
+            self.flush()
+
+    def _take(self):
+        with self._lock:
+            counts, users = self._counts, self._users
+            self._counts = defaultdict(lambda: defaultdict(int))
+            self._users = set()
+        return counts, users
+
+    def _put_back(self, counts, users):
+        with self._lock:
+            for key, fields in counts.items():
+                for field, n in fields.items():
+                    self._counts[key][field] += n
+            self._users.update(users)
+
+    def flush(self):
+        """
+        把累计的增量写入汇总表
+        :return: 写入的汇总行数
+        """
+        counts, users = self._take()
+        if not counts and not users:
+            return 0
+        # 已在请求或任务的 app context 中时直接使用；嵌套的 context 结束时会移除外层的 session
+        if has_app_context():
+            return self._write(counts, users)
+        with app.app_context():
+            return self._write(counts, users)
+
+    def _write(self, counts, users):
+        try:
+            daily = defaultdict(lambda: defaultdict(int))
+            for (day, spread), fields in counts.items():
+                _upsert_increment(AnalyticsDailySpread, {'day': day, 'spread': spread}, dict(fields))
+                for field, n in fields.items():
+                    daily[day][field] += n
+            for day, openid in users:
+                if _insert_ignore(AnalyticsDailyUser, {'day': day, 'openid': openid}):
+                    daily[day]['active_users'] += 1
+            for day, fields in daily.items():
+                _upsert_increment(AnalyticsDaily, {'day': day}, dict(fields))
+            db.session.commit()
+            self.flushes += 1
+            return len(counts) + len(daily)
+        except Exception as e:
+            db.session.rollback()
+            self.errors += 1
+            logger.error("写入统计汇总失败: {}".format(e))
+            self._put_back(counts, users)
+            return 0
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def start(self):
+        """启动定时写入线程（每个进程一次）"""
+        if self.flush_interval <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        self._stop.clear()
+        thread = threading.Thread(target=self._flush_loop, name='analytics-flush')
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        """停止定时写入并写入剩余增量（优雅停止时调用）"""
+        self._stop.set()
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            pending = sum(sum(fields.values()) for fields in self._counts.values())
+            return {'pending_increments': pending, 'pending_users': len(self._users),
+                    'flushes': self.flushes, 'errors': self.errors}
+
+
+# 全局共享的统计记录器
+analytics = AnalyticsRecorder.from_config()
+
+
+def _as_date(value):
+    """func.date() 在 SQLite 中返回字符串"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+
+
+def rebuild_analytics():
+    """
+    由 tarot_readings 和归档表重新计算全部汇总（全表扫描，只在部署迁移或手动修复时执行）
+    历史数据按创建日期归入各天；之后的增量按状态变化日期统计
+    :return: 汇总的记录数
+    """
+    db.session.query(AnalyticsDaily).delete(synchronize_session=False)
+    db.session.query(AnalyticsDailySpread).delete(synchronize_session=False)
+    db.session.query(AnalyticsDailyUser).delete(synchronize_session=False)
+    daily = defaultdict(lambda: defaultdict(int))
+    total = 0
+    for model in (TarotReading, TarotReadingArchive):
+        day = func.date(model.created_at)
+        rows = db.session.query(day, model.spread, model.status, func.count()).group_by(
+            day, model.spread, model.status
+        ).all()
+        spreads = defaultdict(lambda: defaultdict(int))
+        for raw_day, spread, status, count in rows:
+            fields = spreads[(_as_date(raw_day), spread)]
+            fields['submitted'] += count
+            if status in COUNT_FIELDS:
+                fields[status] += count
+            total += count
+        for (d, spread), fields in spreads.items():
+            _upsert_increment(AnalyticsDailySpread, {'day': d, 'spread': spread}, dict(fields))
+            for field, n in fields.items():
+                daily[d][field] += n
+        for raw_day, openid in db.session.query(day, model.openid).distinct().all():
+            d = _as_date(raw_day)
+            if _insert_ignore(AnalyticsDailyUser, {'day': d, 'openid': openid}):
+                daily[d]['active_users'] += 1
+    for d, fields in daily.items():
+        _upsert_increment(AnalyticsDaily, {'day': d}, dict(fields))
+    db.session.commit()
+    return total
+
+
+def backfill_analytics():
+    """汇总表为空、而已有解读记录时（首次部署统计功能）执行一次完整汇总"""
+    if db.session.query(AnalyticsDaily.day).first() is not None:
+        return 0
+    if db.session.query(TarotReading.id).first() is None:
+        return 0
+    total = rebuild_analytics()
+    logger.info("已根据 {} 条解读记录生成统计汇总".format(total))
+    return total
+
+
+def query_dashboard(days=7, top_spreads=10):
+    """
+    管理端看板：最近 days 天的每日汇总，以及该时间段内提交最多的牌阵
+    只读取汇总表，耗时与 tarot_readings 的大小无关
+    """
+    since = china_now().date() - timedelta(days=days - 1)
+    daily = AnalyticsDaily.query.filter(AnalyticsDaily.day >= since).order_by(AnalyticsDaily.day).all()
+    submitted = func.sum(AnalyticsDailySpread.submitted)
+    spreads = db.session.query(
+        AnalyticsDailySpread.spread, submitted,
+        func.sum(AnalyticsDailySpread.completed), func.sum(AnalyticsDailySpread.failed)
+    ).filter(
+        AnalyticsDailySpread.day >= since
+    ).group_by(AnalyticsDailySpread.spread).order_by(submitted.desc()).limit(top_spreads).all()
+    totals = {field: sum(getattr(row, field) for row in daily) for field in COUNT_FIELDS}
+    return {
+        'since': since.isoformat(),
+        'totals': totals,
+        'failure_rate': round(totals['failed'] / float(totals['completed'] + totals['failed']), 4)
+        if totals['completed'] + totals['failed'] else None,
+        'daily': [{
+            'day': row.day.isoformat(),
+            'submitted': row.submitted,
+            'completed': row.completed,
+            'failed': row.failed,
+            'active_users': row.active_users,
+        } for row in daily],
+        'spreads': [{
+            'spread': spread,
+            'submitted': int(s or 0),
+            'completed': int(c or 0),
+            'failed': int(f or 0),
+        } for spread, s, c, f in spreads],
+    }
+
+
+def query_total_submitted():
+    """累计提交的解读数（汇总表求和）"""
+    return int(db.session.query(func.coalesce(func.sum(AnalyticsDaily.submitted), 0)).scalar())
+
+
+@app.cli.command('rebuild-analytics')
+def rebuild_analytics_command():
+    """根据解读记录重新计算统计汇总（flask rebuild-analytics）"""
+    start = time.monotonic()
+    total = rebuild_analytics()
+    print("统计汇总已重建, 记录数={}, 耗时 {:.0f} ms".format(total, (time.monotonic() - start) * 1000))
@@ -0,0 +1,224 @@
+import logging
+import os
+import random
+import threading
+import time
+from datetime import timedelta
+
+from sqlalchemy import delete, func, insert, literal, select
+
+import config
+from wxcloudrun import app, db
+from wxcloudrun.metrics import ARCHIVED
+from wxcloudrun.model import TarotReading, TarotReadingArchive, china_now
+
+logger = logging.getLogger('log')
+
+# 复制到归档表的列（与 TarotReadingArchive 同名）
+ARCHIVE_COLUMNS = ('id', 'openid', 'question', 'cards', 'spread', 'positions', 'status', 'result', 'excerpt',
+                   'is_deleted', 'created_at')
+# 只归档已结束的任务，执行中的记录等结束后再归档
+FINISHED_STATUSES = ('completed', 'failed')
+# MySQL 命名锁：多个进程/实例同时运行时只有一个执行归档
+ARCHIVE_LOCK_NAME = 'tarot_readings_archive'
+
+_stop = threading.Event()
+_archiver_pid = None
+_archiver_lock = threading.Lock()
+
+
+def _move_readings(ids, now):
+    """在一个短事务内把 ids 对应的记录复制到归档表并从 tarot_readings 删除"""
+    source = select(*[getattr(TarotReading, name) for name in ARCHIVE_COLUMNS] + [literal(now)]).where(
+        TarotReading.id.in_(ids)
+    )
+    stmt = insert(TarotReadingArchive.__table__).from_select(list(ARCHIVE_COLUMNS) + ['archived_at'], source)
+    # 上次归档中断时可能已复制过，忽略主键冲突
+    dialect = db.engine.dialect.name
+    if dialect == 'mysql':
+        stmt = stmt.prefix_with('IGNORE')
+    elif dialect == 'sqlite':
+        stmt = stmt.prefix_with('OR IGNORE')
+    try:
+        db.session.execute(stmt)
+        db.session.execute(delete(TarotReading.__table__).where(TarotReading.id.in_(ids)))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def _deleted_batch(last_id, batch_size):
+    """按 id 顺序取下一批已软删除、已结束的记录（idx_tarot_readings_deleted）"""
+    rows = db.session.query(TarotReading.id).filter(
+        TarotReading.is_deleted == True,
+        TarotReading.id > last_id,
+        TarotReading.status.in_(FINISHED_STATUSES)
+    ).order_by(TarotReading.id).limit(batch_size).all()
+    return [row[0] for row in rows]
+
+
+def _expired_batch(last_id, cutoff, batch_size):
+    """
+    按主键顺序取下一批记录，挑出创建时间早于 cutoff 的已结束记录
+    id 与创建时间同向增长，遇到不早于 cutoff 的记录即说明已扫描到保留期内
+    :return: (待归档的 id 列表, 本批最后一个 id, 是否已扫描到保留期内)
+    """
+    rows = db.session.query(TarotReading.id, TarotReading.created_at, TarotReading.status).filter(
+        TarotReading.id > last_id
+    ).order_by(TarotReading.id).limit(batch_size).all()
+    if not rows:
+        return [], last_id, True
+    ids = [r.id for r in rows if r.created_at < cutoff and r.status in FINISHED_STATUSES]
+    reached = any(r.created_at >= cutoff for r in rows) or len(rows) < batch_size
+    return ids, rows[-1].id, reached
+
+
+def _purge_batch(cutoff, batch_size):
+    """删除一批归档时间早于 cutoff 的归档记录（idx_tarot_readings_archive_archived）"""
+    rows = db.session.query(TarotReadingArchive.id).filter(
+        TarotReadingArchive.archived_at < cutoff
+    ).order_by(TarotReadingArchive.archived_at, TarotReadingArchive.id).limit(batch_size).all()
+    ids = [row[0] for row in rows]
+    if ids:
+        try:
+            db.session.execute(delete(TarotReadingArchive.__table__).where(TarotReadingArchive.id.in_(ids)))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    return ids
+
+
+def run_archive(batch_size=None, pause=None, max_batches=None):
+    """
+    执行一轮归档（需在 app context 中调用）：
+    1. 已软删除的记录移到归档表
+    2. 超过 READING_RETENTION_DAYS 的已结束记录移到归档表
+    3. 归档超过 ARCHIVE_PURGE_DAYS 的记录彻底删除
+    每批一个短事务，批次之间停顿 pause 秒；每个阶段各自最多 max_batches 批，剩余记录留到下一轮
+    :return: {'deleted': n, 'expired': n, 'purged': n, 'batches': n}
+    """
+    batch_size = batch_size or config.ARCHIVE_BATCH_SIZE
+    pause = config.ARCHIVE_BATCH_PAUSE if pause is None else pause
+    max_batches = max_batches or config.ARCHIVE_MAX_BATCHES
+    counts = {'deleted': 0, 'expired': 0, 'purged': 0, 'batches': 0}
+    # 各阶段的批次预算互相独立，已删除记录积压时不会挤占过期记录和清理的批次
+    phase = {'batches': 0}
+
+    def budget_left():
+        return phase['batches'] < max_batches and not _stop.is_set()
+
+    def throttle():
+        phase['batches'] += 1
+        counts['batches'] += 1
+        if pause:
+            time.sleep(pause)
+
+    last_id = 0
+    while budget_left():
+        ids = _deleted_batch(last_id, batch_size)
+        if not ids:
+            break
+        _move_readings(ids, china_now())
+        counts['deleted'] += len(ids)
+        ARCHIVED.inc('deleted', amount=len(ids))
+        last_id = ids[-1]
+        throttle()
+        if len(ids) < batch_size:
+            break
+
+    if config.READING_RETENTION_DAYS > 0:
+        cutoff = china_now() - timedelta(days=config.READING_RETENTION_DAYS)
+        # 从当前最小 id 开始：更早的记录都已归档，无需每轮从头扫描
+        min_id = db.session.query(func.min(TarotReading.id)).scalar()
+        last_id = (min_id or 1) - 1
+        phase['batches'] = 0
+        while budget_left():
+            ids, last_id, reached = _expired_batch(last_id, cutoff, batch_size)
+            if ids:
+                _move_readings(ids, china_now())
+                counts['expired'] += len(ids)
+                ARCHIVED.inc('expired', amount=len(ids))
+            throttle()
+            if reached:
+                break
+
+    if config.ARCHIVE_PURGE_DAYS > 0:
+        cutoff = china_now() - timedelta(days=config.ARCHIVE_PURGE_DAYS)
+        phase['batches'] = 0
+        while budget_left():
+            ids = _purge_batch(cutoff, batch_size)
+            if not ids:
+                break
+            counts['purged'] += len(ids)
+            ARCHIVED.inc('purged', amount=len(ids))
+            throttle()
+            if len(ids) < batch_size:
+                break
+
+    if counts['deleted'] or counts['expired'] or counts['purged']:
+        logger.info("归档完成: 已删除记录 {deleted} 条, 过期记录 {expired} 条, 清理归档 {purged} 条, 批次 {batches}"
+                    .format(**counts))
+    return counts
+
+
+def archive_once():
+    """
+    执行一轮归档；MySQL 下用命名锁保证同一时刻只有一个进程在归档
+    :return: run_archive 的统计，未获得锁时返回 None
+    """
+    with app.app_context():
+        if db.engine.dialect.name != 'mysql':
+            return run_archive()
+        with db.engine.connect() as conn:
+            if conn.exec_driver_sql("SELECT GET_LOCK('{}', 0)".format(ARCHIVE_LOCK_NAME)).scalar() != 1:
+                return None
+            try:
+                return run_archive()
+            finally:
+                conn.exec_driver_sql("SELECT RELEASE_LOCK('{}')".format(ARCHIVE_LOCK_NAME))
+
+
+def _archive_loop():
+    # 错开各进程的首次执行时间
+    if _stop.wait(random.uniform(0, config.ARCHIVE_INTERVAL)):
+        return
+    while True:
+        try:
+            archive_once()
+        except Exception as e:
+            logger.error("归档解读记录失败: {}".format(e))
+        if _stop.wait(config.ARCHIVE_INTERVAL):
+            return
+
+
+def start_archiver():
+    """启动归档线程（每个进程一次）；ARCHIVE_INTERVAL 为 0 时不启动"""
+    global _archiver_pid
+    if config.ARCHIVE_INTERVAL <= 0:
+        return
+    with _archiver_lock:
+        if _archiver_pid == os.getpid():
+            return
+        _archiver_pid = os.getpid()
+    _stop.clear()
+    thread = threading.Thread(target=_archive_loop, name='reading-archiver')
+    thread.daemon = True
+    thread.start()
+
+
+def stop_archiver():
+    """停止归档线程：进行中的一轮在当前批次结束后退出"""
+    _stop.set()
+
+
+@app.cli.command('archive')
+def archive_command():
+    """执行一轮解读记录归档（flask archive，等同于 python run.py archive），可由定时任务调用"""
+    start = time.monotonic()
+    counts = archive_once()
+    if counts is None:
+        print("其他进程正在归档，已跳过")
+        return
+    print("归档完成, {}, 耗时 {:.0f} ms".format(counts, (time.monotonic() - start) * 1000))
@@ -0,0 +1,91 @@
+import logging
+import os
+import threading
+import time
+
+import config
+from wxcloudrun import app, db, IMPORT_STARTED_AT
+from wxcloudrun.deepseek import deepseek_client
+from wxcloudrun.images import card_images
+from wxcloudrun.migrate import migrate, migrations_needed
+
+logger = logging.getLogger('log')
+
+_lock = threading.Lock()
+_state = {'pid': None}
+
+
+def bootstrap():
+    """
+    启动前执行（gunicorn 主进程 fork 工作进程之前）：
+    结构版本与数据库记录一致时只需一次主键查询；不一致时执行完整迁移
+    结束后释放主进程持有的连接，避免被 fork 出的工作进程共享
+    :return: 是否执行了迁移
+    """
+    if not config.MIGRATE_ON_START:
+        return False
+    start = time.monotonic()
+    with app.app_context():
+        needed = migrations_needed()
+    if needed:
+        migrate()
+    db.engine.dispose()
+    logger.info("启动检查完成, 执行迁移={}, 耗时 {:.0f} ms".format(needed, (time.monotonic() - start) * 1000))
+    return needed
+
+
+def _warm_db(connections):
+    """预先建立 connections 个数据库连接并放回连接池"""
+    opened = []
+    try:
+        for _ in range(connections):
+            conn = db.engine.connect()
+            opened.append(conn)
+            conn.exec_driver_sql('SELECT 1')
+    finally:
+        for conn in opened:
+            conn.close()
+
+
+def warmup():
+    """
+    工作进程启动时预热：数据库连接、DeepSeek HTTPS 连接、图片清单
+    完成后 /api/ready 才返回就绪；数据库或图片清单不可用时保持未就绪，
+    /api/ready 在未就绪时会再次调用本函数，恢复后（如图片清单后台刷新成功）即转为就绪
+    :return: 是否就绪
+    """
+    with _lock:
+        if _state.get('pid') == os.getpid() and _state.get('ready'):
+            return True
+        start = time.monotonic()
+        error = None
+        try:
+            _warm_db(config.WARMUP_DB_CONNECTIONS)
+        except Exception as e:
+            error = str(e)
+            logger.error("预热数据库连接失败: {}".format(e))
+        # 上游连接失败不影响就绪，首次调用时再建立
+        deepseek_client.warmup()
+        # 图片清单缺失时图片接口只能返回默认图，视为未就绪，在部署时暴露出来
+        if not card_images.start() and error is None:
+            error = '图片清单加载失败'
+        now = time.monotonic()
+        _state.clear()
+        _state.update({
+            'pid': os.getpid(),
+            'ready': error is None,
+            'error': error,
+            'warmup_ms': round((now - start) * 1000, 1),
+            'import_to_ready_ms': round((now - IMPORT_STARTED_AT) * 1000, 1),
+        })
+        logger.info("工作进程预热完成, pid={}, ready={}, 预热 {} ms, 导入到就绪 {} ms".format(
+            os.getpid(), _state['ready'], _state['warmup_ms'], _state['import_to_ready_ms']))
+        return _state['ready']
+
+
+def readiness():
+    """当前进程的就绪状态"""
+    with _lock:
+        if _state.get('pid') != os.getpid():
+            return {'ready': False}
+        return dict(_state)
@@ -0,0 +1,159 @@
+import json
+import logging
+import threading
+from datetime import timedelta
+
+import config
+from wxcloudrun.dao import query_reading_cache, save_reading_cache, incr_reading_cache_hits, \
+    delete_reading_cache
+from wxcloudrun.deepseek import call_deepseek, build_cache_key, RESULT_REQUIRED_KEYS
+from wxcloudrun.lru import LRUTTLCache
+from wxcloudrun.model import china_now
+
+logger = logging.getLogger('log')
+
+
+class _CachedResult(object):
+    __slots__ = ('result', 'uses')
+
+    def __init__(self, result, uses=0):
+        self.result = result
+        self.uses = uses
+
+
+class InterpretationCache(object):
+    """
+    解读结果缓存
+    - 内存中按 LRU + TTL 淘汰
+    - 可选持久化到 MySQL reading_cache 表，服务重启后仍可命中
+    - 每条结果最多复用 max_reuse 次，用满后重新生成，避免用户觉得答案千篇一律
+    """
+
+    def __init__(self, maxsize, ttl, max_reuse, persist=False):
+        self.ttl = float(ttl)
+        self.max_reuse = max(0, int(max_reuse))
+        self.persist = persist
+        self._entries = LRUTTLCache(maxsize, ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.db_hits = 0
+        self.exhausted = 0
+
+    @classmethod
+    def from_config(cls):
+        return cls(
+            maxsize=config.READING_CACHE_SIZE if config.READING_CACHE_ENABLED else 0,
+            ttl=config.READING_CACHE_TTL,
+            max_reuse=config.READING_CACHE_MAX_REUSE,
+            persist=config.READING_CACHE_ENABLED and config.READING_CACHE_PERSIST,
+        )
+
+    @property
+    def enabled(self):
+        return self._entries.maxsize > 0 and self.max_reuse > 0
+
+    def _load(self, key):
+        """从数据库加载缓存条目（需在 app context 中调用）"""
+        row = query_reading_cache(key)
+        if row is None:
+            return None
+        if row.created_at and row.created_at < china_now() - timedelta(seconds=self.ttl):
+            delete_reading_cache(key)
+            return None
+        entry = _CachedResult(row.result, row.hit_count or 0)
+        remaining = self.ttl
+        if row.created_at:
+            remaining -= (china_now() - row.created_at).total_seconds()
+        self._entries.set(key, entry, ttl=max(1.0, remaining))
+        return entry
+
+    def get(self, key):
+        """
+        查询缓存，命中时计入一次复用
+        :return: 解读结果 JSON 字符串，未命中返回 None
+        """
+        if not self.enabled:
+            return None
+        entry = self._entries.get(key)
+        from_db = False
+        if entry is None and self.persist:
+            entry = self._load(key)
+            from_db = entry is not None
+
+        with self._lock:
+            if entry is None or entry.uses >= self.max_reuse:
+                if entry is not None:
+                    self.exhausted += 1
+                self.misses += 1
+                return None
+            entry.uses += 1
+            self.hits += 1
+            if from_db:
+                self.db_hits += 1
+            exhausted = entry.uses >= self.max_reuse
+
+        if exhausted:
+            # 复用次数已满，下一次请求重新生成
+            self._entries.pop(key)
+            if self.persist:
+                delete_reading_cache(key)
+        elif self.persist:
+            incr_reading_cache_hits(key)
+        return entry.result
+
+    def put(self, key, result):
+        if not self.enabled:
+            return
+        self._entries.set(key, _CachedResult(result))
+        if self.persist:
+            save_reading_cache(key, result)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'persist': self.persist,
+                'size': len(self._entries),
+                'max_size': self._entries.maxsize,
+                'ttl': self.ttl,
+                'max_reuse': self.max_reuse,
+                'hits': self.hits,
+                'misses': self.misses,
+                'db_hits': self.db_hits,
+                'exhausted': self.exhausted,
+                'hit_rate': round(self.hits / float(lookups), 4) if lookups else 0.0,
+            }
+
+
+def _is_complete_result(result):
+    """只缓存结构完整的解读，fallback 结构不进入缓存"""
+    try:
+        data = json.loads(result)
+    except (json.JSONDecodeError, TypeError):
+        return False
+    return isinstance(data, dict) and all(data.get(key) for key in RESULT_REQUIRED_KEYS)
+
+
+# 全局共享的解读结果缓存
+interpretation_cache = InterpretationCache.from_config()
+
+
+def call_deepseek_cached(question, cards, spread, positions=None, on_delta=None, on_section=None):
+    """
+    带缓存的 call_deepseek，参数与返回值相同
+    命中缓存时不调用大模型；流式模式下一次性回调完整结果，不回调 on_section
+    """
+    key = build_cache_key(question, cards, spread, positions)
+    cached = interpretation_cache.get(key)
+    if cached is not None:
+        if on_delta is not None:
+            on_delta(cached)
+        return True, "解读成功", cached
+
+    success, msg, result = call_deepseek(question, cards, spread, positions, on_delta=on_delta,
+                                         on_section=on_section)
+    if success and _is_complete_result(result):
+        interpretation_cache.put(key, result)
+    return success, msg, result
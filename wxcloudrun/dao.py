@@ -1,16 +1,68 @@
+import base64
+import json
 import logging
+from datetime import datetime
 
+from sqlalchemy import and_, or_
+from sqlalchemy.dialects import mysql, sqlite
 from sqlalchemy.exc import OperationalError
 
+import config
 from wxcloudrun import db
-from wxcloudrun.model import User, TarotReading
+from wxcloudrun.lru import LRUTTLCache
+from wxcloudrun.model import User, TarotReading, ReadingCache, china_now
 
 # 初始化日志
 logger = logging.getLogger('log')
 
+# 已确认存在于 users 表的 openid，命中时写路径无需再访问数据库
+known_users = LRUTTLCache(config.USER_CACHE_SIZE, config.USER_CACHE_TTL)
+
 
 # ============ 用户相关操作 ============
 
+def _upsert_user(openid, nickname=None, avatar_url=None):
+    """
+    单条语句插入用户，openid 已存在时只刷新最后活跃时间
+    MySQL 使用 INSERT ... ON DUPLICATE KEY UPDATE，并发首次请求不会触发唯一键冲突
+    """
+    now = china_now()
+    values = {'openid': openid, 'nickname': nickname, 'avatar_url': avatar_url,
+              'created_at': now, 'updated_at': now}
+    dialect = db.engine.dialect.name
+    if dialect == 'mysql':
+        stmt = mysql.insert(User).values(**values).on_duplicate_key_update(updated_at=now)
+    elif dialect == 'sqlite':
+        stmt = sqlite.insert(User).values(**values).on_conflict_do_update(
+            index_elements=['openid'], set_={'updated_at': now}
+        )
+    else:
+        if User.query.filter_by(openid=openid).first() is None:
+            db.session.add(User(**values))
+        db.session.commit()
+        return
+    db.session.execute(stmt)
+    db.session.commit()
+
+
+def ensure_user(openid):
+    """
+    确保用户存在（提交解读等写路径使用）
+    近期确认过的 openid 直接返回，不访问数据库；否则执行一次 upsert
+    :return: 是否成功
+    """
+    if openid in known_users:
+        return True
+    try:
+        _upsert_user(openid)
+        known_users.set(openid, True)
+        return True
+    except Exception as e:
+        db.session.rollback()
+        logger.error("ensure_user errorMsg= {} ".format(e))
+        return False
+
+
 def get_or_create_user(openid, nickname=None, avatar_url=None):
     """
     根据 openid 获取用户，不存在则自动创建
@@ -19,12 +71,10 @@ def get_or_create_user(openid, nickname=None, avatar_url=None):
     try:
         user = User.query.filter_by(openid=openid).first()
         if user is None:
-            user = User()
-            user.openid = openid
-            user.nickname = nickname
-            user.avatar_url = avatar_url
-            db.session.add(user)
-            db.session.commit()
+            _upsert_user(openid, nickname, avatar_url)
+            user = User.query.filter_by(openid=openid).first()
+        if user is not None:
+            known_users.set(openid, True)
         return user
     except Exception as e:
         db.session.rollback()
@@ -82,26 +132,58 @@ def insert_tarot_reading(reading):
         return None
 
 
-def update_tarot_reading(reading_id, status, result=None):
+def transition_tarot_reading(reading_id, from_status, to_status, result=None, excerpt=None, payload=None):
     """
-    更新塔罗牌解读记录的状态和结果
-    :param reading_id: 记录ID
-    :param status: 新状态
-    :param result: 解读结果（可选）
+    状态迁移（compare-and-set）：UPDATE ... WHERE id=? AND status=?
+    只有当前状态等于 from_status 时才更新，并发的工作线程不会互相覆盖
+    迁移到 processing 时记录 started_at，作为执行租约的起点
+    :param from_status: 期望的当前状态，可为元组表示多个状态之一
+    :param to_status: 新状态
+    :return: 是否发生了迁移
     """
+    # 部分结果只在 processing 期间有效
+    values = {'status': to_status, 'partial_result': None}
+    if to_status == 'processing':
+        values['started_at'] = china_now()
+    if result is not None:
+        values['result'] = result
+    if excerpt is not None:
+        values['excerpt'] = excerpt
+    if payload is not None:
+        values['result_payload'] = payload
     try:
-        reading = TarotReading.query.get(reading_id)
-        if reading is None:
-            logger.error("update_tarot_reading: 记录不存在, id={}".format(reading_id))
-            return False
-        reading.status = status
-        if result is not None:
-            reading.result = result
+        query = TarotReading.query.filter(TarotReading.id == reading_id)
+        if isinstance(from_status, (list, tuple)):
+            query = query.filter(TarotReading.status.in_(from_status))
+        else:
+            query = query.filter(TarotReading.status == from_status)
+        count = query.update(values, synchronize_session=False)
         db.session.commit()
-        return True
+        if count != 1:
+            logger.warning("transition_tarot_reading: 未迁移, id={}, {} -> {}".format(
+                reading_id, from_status, to_status))
+        return count == 1
+    except Exception as e:
+        db.session.rollback()
+        logger.error("transition_tarot_reading errorMsg= {} ".format(e))
+        return False
+
+
+def save_partial_result(reading_id, partial):
+    """
+    保存解读中已生成完毕的字段（JSON 字符串），只在记录仍处于 processing 时写入
+    :return: 是否写入
+    """
+    try:
+        count = TarotReading.query.filter(
+            TarotReading.id == reading_id,
+            TarotReading.status == 'processing'
+        ).update({'partial_result': partial}, synchronize_session=False)
+        db.session.commit()
+        return count == 1
     except Exception as e:
         db.session.rollback()
-        logger.error("update_tarot_reading errorMsg= {} ".format(e))
+        logger.error("save_partial_result errorMsg= {} ".format(e))
         return False
 
 
@@ -116,16 +198,100 @@ def query_tarot_reading_by_id(reading_id):
         return None
 
 
-def query_readings_by_openid(openid, page=1, page_size=10):
+def query_tarot_reading_state(reading_id):
+    """
+    只查询解读记录的归属、状态、部分结果和预生成的响应体（不加载 result 大字段），用于轮询
+    解读完成前 result_payload 为空，完成后一次查询即可直接返回；解读中 partial_result 为已完成的字段
+    :return: (openid, status, partial_result, result_payload) 行，记录不存在时返回 None
+    """
+    try:
+        return db.session.query(
+            TarotReading.openid, TarotReading.status, TarotReading.partial_result, TarotReading.result_payload
+        ).filter(
+            TarotReading.id == reading_id
+        ).first()
+    except Exception as e:
+        logger.error("query_tarot_reading_state errorMsg= {} ".format(e))
+        return None
+
+
+def query_reading_by_idempotency_key(openid, idempotency_key):
+    """
+    根据用户和幂等键查询已创建的解读记录ID
+    :return: 记录ID，不存在时返回 None
+    """
+    try:
+        row = db.session.query(TarotReading.id).filter(
+            TarotReading.openid == openid,
+            TarotReading.idempotency_key == idempotency_key
+        ).first()
+        return row[0] if row else None
+    except Exception as e:
+        logger.error("query_reading_by_idempotency_key errorMsg= {} ".format(e))
+        return None
+
+
+def query_pending_readings(created_after, created_before, limit=100):
+    """
+    查询创建时间在 [created_after, created_before) 内、仍处于 pending 状态的解读记录
+    用于服务重启后把未执行的任务重新放回线程池
+    """
+    try:
+        return TarotReading.query.filter(
+            TarotReading.status == 'pending',
+            TarotReading.created_at >= created_after,
+            TarotReading.created_at < created_before
+        ).order_by(
+            TarotReading.created_at.asc()
+        ).limit(limit).all()
+    except Exception as e:
+        logger.error("query_pending_readings errorMsg= {} ".format(e))
+        return []
+
+
+def reclaim_stale_readings(started_before, limit=100):
+    """
+    把 started_at 早于 started_before、仍处于 processing 的记录退回 pending（执行租约过期）
+    覆盖的情况：工作进程被强制杀死，任务没来得及退回 pending
+    更新条件同时校验状态和租约（compare-and-set），期间已结束的记录不受影响
+    :return: 退回 pending 的记录数
+    """
+    # 本字段上线前进入 processing 的记录没有 started_at，按创建时间判断
+    lease_expired = or_(
+        TarotReading.started_at < started_before,
+        and_(TarotReading.started_at.is_(None), TarotReading.created_at < started_before)
+    )
+    try:
+        rows = db.session.query(TarotReading.id).filter(
+            TarotReading.status == 'processing',
+            lease_expired
+        ).limit(limit).all()
+        if not rows:
+            return 0
+        count = TarotReading.query.filter(
+            TarotReading.id.in_([row[0] for row in rows]),
+            TarotReading.status == 'processing',
+            lease_expired
+        ).update({'status': 'pending', 'partial_result': None}, synchronize_session=False)
+        db.session.commit()
+        return count
+    except Exception as e:
+        db.session.rollback()
+        logger.error("reclaim_stale_readings errorMsg= {} ".format(e))
+        return 0
+
+
+def query_readings_by_openid(openid, page=1, page_size=10, columns=None):
     """
     根据openid查询用户的塔罗牌解读历史记录（排除已软删除的）
     :param openid: 用户微信openid
     :param page: 页码
     :param page_size: 每页条数
+    :param columns: 只查询的列名列表，为空时查询整行
     :return: 解读记录列表
     """
     try:
-        return TarotReading.query.filter(
+        return _readings_query(columns).filter(
             TarotReading.openid == openid,
             TarotReading.is_deleted == False
         ).order_by(
@@ -136,6 +302,74 @@ def query_readings_by_openid(openid, page=1, page_size=10):
         return None
 
 
+def encode_history_cursor(reading):
+    """将一条记录的 (created_at, id) 编码为不透明的游标字符串"""
+    raw = json.dumps([reading.created_at.strftime('%Y-%m-%d %H:%M:%S.%f'), reading.id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_history_cursor(cursor):
+    """
+    解析游标字符串
+    :return: (created_at, id)，格式不合法时返回 None
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, reading_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S.%f'), int(reading_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def _readings_query(columns=None):
+    """
+    构造历史记录查询；指定 columns 时只查询这些列（返回行元组），避免加载 result 大字段
+    """
+    if not columns:
+        return TarotReading.query
+    return db.session.query(*[getattr(TarotReading, name) for name in columns])
+
+
+def query_readings_by_cursor(openid, cursor=None, page_size=10, with_total=False, columns=None):
+    """
+    根据openid按游标分页查询历史记录（排除已软删除的）
+    按 (created_at, id) 倒序，走 (openid, is_deleted, created_at, id) 联合索引，
+    无论翻到多深，每页耗时都与第一页相同
+    :param cursor: 上一页返回的 next_cursor，为空表示第一页
+    :param with_total: 是否额外统计总条数（需要一次 COUNT 查询）
+    :param columns: 只查询的列名列表（需包含 id 和 created_at），为空时查询整行
+    :return: (records, next_cursor, total)，失败返回 None
+    """
+    try:
+        base = _readings_query(columns).filter(
+            TarotReading.openid == openid,
+            TarotReading.is_deleted == False
+        )
+        query = base
+        if cursor:
+            created_at, reading_id = cursor
+            query = query.filter(or_(
+                TarotReading.created_at < created_at,
+                and_(TarotReading.created_at == created_at, TarotReading.id < reading_id)
+            ))
+        # 多取一条用于判断是否还有下一页
+        records = query.order_by(
+            TarotReading.created_at.desc(),
+            TarotReading.id.desc()
+        ).limit(page_size + 1).all()
+
+        next_cursor = None
+        if len(records) > page_size:
+            records = records[:page_size]
+            next_cursor = encode_history_cursor(records[-1])
+
+        total = base.order_by(None).count() if with_total else None
+        return records, next_cursor, total
+    except Exception as e:
+        logger.error("query_readings_by_cursor errorMsg= {} ".format(e))
+        return None
+
+
 def soft_delete_reading(reading_id, openid):
     """
     软删除单条塔罗牌解读记录
@@ -160,20 +394,96 @@ def soft_delete_reading(reading_id, openid):
         return False, '删除失败'
 
 
-def soft_delete_all_readings(openid):
+def soft_delete_all_readings(openid, chunk_size=None):
     """
     软删除用户的所有塔罗牌解读记录
+    按 chunk_size 分批更新并逐批提交，记录很多的用户也不会长时间锁住大量行
     :param openid: 用户openid
-    :return: (success, msg, count)
+    :return: (success, msg, count)，中途失败时 count 为已删除的条数
     """
+    chunk_size = chunk_size or config.DELETE_ALL_CHUNK_SIZE
+    total = 0
     try:
-        count = TarotReading.query.filter(
-            TarotReading.openid == openid,
-            TarotReading.is_deleted == False
-        ).update({'is_deleted': True})
-        db.session.commit()
-        return True, '删除成功', count
+        while True:
+            rows = db.session.query(TarotReading.id).filter(
+                TarotReading.openid == openid,
+                TarotReading.is_deleted == False
+            ).order_by(TarotReading.created_at, TarotReading.id).limit(chunk_size).all()
+            if not rows:
+                break
+            total += TarotReading.query.filter(
+                TarotReading.id.in_([row[0] for row in rows]),
+                TarotReading.is_deleted == False
+            ).update({'is_deleted': True}, synchronize_session=False)
+            db.session.commit()
+            if len(rows) < chunk_size:
+                break
+        return True, '删除成功', total
     except Exception as e:
         db.session.rollback()
         logger.error("soft_delete_all_readings errorMsg= {} ".format(e))
-        return False, '删除失败', 0
+        return False, '删除失败', total
+
+
+# ============ 解读结果缓存相关操作 ============
+
+def query_reading_cache(cache_key):
+    """
+    根据缓存键查询已持久化的解读结果
+    """
+    try:
+        return ReadingCache.query.get(cache_key)
+    except Exception as e:
+        logger.error("query_reading_cache errorMsg= {} ".format(e))
+        return None
+
+
+def save_reading_cache(cache_key, result):
+    """
+    写入（或覆盖）一条解读结果缓存，复用次数清零
+    """
+    try:
+        entry = ReadingCache.query.get(cache_key)
+        if entry is None:
+            entry = ReadingCache()
+            entry.cache_key = cache_key
+            db.session.add(entry)
+        entry.result = result
+        entry.hit_count = 0
+        entry.created_at = china_now()
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        logger.error("save_reading_cache errorMsg= {} ".format(e))
+        return False
+
+
+def incr_reading_cache_hits(cache_key):
+    """
+    缓存命中后累加复用次数
+    """
+    try:
+        ReadingCache.query.filter(ReadingCache.cache_key == cache_key).update(
+            {'hit_count': ReadingCache.hit_count + 1}, synchronize_session=False
+        )
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        logger.error("incr_reading_cache_hits errorMsg= {} ".format(e))
+        return False
+
+
+def delete_reading_cache(cache_key):
+    """
+    删除一条解读结果缓存（过期或复用次数已满）
+    """
+    try:
+        ReadingCache.query.filter(ReadingCache.cache_key == cache_key).delete(synchronize_session=False)
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        logger.error("delete_reading_cache errorMsg= {} ".format(e))
+        return False
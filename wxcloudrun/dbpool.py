@@ -0,0 +1,113 @@
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+import config
+
+
+class PoolStats(object):
+    """连接池累计指标（跨 pool.recreate() 保留）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+        self.connects = 0
+        self.invalidations = 0
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'avg_wait_ms': round(self.wait_total * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+                'max_wait_ms': round(self.wait_max * 1000, 3),
+                'timeouts': self.timeouts,
+                'connects': self.connects,
+                'invalidations': self.invalidations,
+            }
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """记录获取连接等待时间和超时次数的 QueuePool"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super(InstrumentedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            pool_stats.record_timeout()
+            raise
+        pool_stats.record_wait(time.perf_counter() - start)
+        return conn
+
+
+@event.listens_for(InstrumentedQueuePool, 'connect')
+def _on_connect(dbapi_connection, connection_record):
+    pool_stats.incr('connects')
+
+
+@event.listens_for(InstrumentedQueuePool, 'invalidate')
+def _on_invalidate(dbapi_connection, connection_record, exception):
+    pool_stats.incr('invalidations')
+
+
+def engine_options(database_uri):
+    """
+    根据配置生成 SQLALCHEMY_ENGINE_OPTIONS
+    - pool_pre_ping：取连接时先探活，避免 MySQL 空闲超时后的 "server has gone away"
+    - pool_recycle：连接使用超过该秒数后重建，需小于 MySQL wait_timeout
+    - pool_size：默认等于解读工作线程数 + 请求处理线程数
+    SQLite（本地调试、基准测试）连接不能跨线程共享，保留 SQLAlchemy 的默认连接池
+    """
+    if database_uri.startswith('sqlite'):
+        return {}
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': config.DB_POOL_SIZE,
+        'max_overflow': config.DB_MAX_OVERFLOW,
+        'pool_timeout': config.DB_POOL_TIMEOUT,
+        'pool_recycle': config.DB_POOL_RECYCLE,
+        'pool_pre_ping': config.DB_POOL_PRE_PING,
+    }
+
+
+def describe_pool(engine):
+    """当前连接池状态 + 累计指标"""
+    pool = engine.pool
+    info = {
+        'pool_class': type(pool).__name__,
+        'pre_ping': config.DB_POOL_PRE_PING,
+        'recycle': config.DB_POOL_RECYCLE,
+    }
+    if isinstance(pool, QueuePool):
+        info.update({
+            'size': pool.size(),
+            'max_overflow': config.DB_MAX_OVERFLOW,
+            'timeout': pool.timeout(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(0, pool.overflow()),
+        })
+    info.update(pool_stats.snapshot())
+    return info
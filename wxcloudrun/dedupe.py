@@ -0,0 +1,105 @@
+import threading
+
+import config
+from wxcloudrun.lru import LRUTTLCache
+
+
+class _Flight(object):
+    """正在创建中的一次提交，相同提交的并发请求等待它完成"""
+    __slots__ = ('key', 'ttl', 'replay_failed', 'event', 'reading_id')
+
+    def __init__(self, key, ttl, replay_failed):
+        self.key = key
+        self.ttl = ttl
+        self.replay_failed = replay_failed
+        self.event = threading.Event()
+        self.reading_id = None
+
+
+class SubmissionDeduper(object):
+    """
+    解读提交的合并（single-flight）
+    - 首个请求成为 leader，负责写入记录并提交任务，完成后调用 finish() 公布 reading_id
+    - leader 完成前到达的相同提交等待最多 flight_wait 秒，拿到同一个 reading_id
+    - leader 完成后 ttl 秒内的相同提交直接返回已记录的 reading_id
+    leader 失败（finish 传入 None）时等待中的请求各自重新竞争 leader
+    解读失败（mark_failed）后，replay_failed 为 False 的提交不再返回该记录，重试会创建新的解读
+    只在进程内生效；客户端幂等键另由数据库唯一索引保证跨进程、跨重启
+    """
+
+    def __init__(self, maxsize, flight_wait=5, failed_ttl=60):
+        self.flight_wait = float(flight_wait)
+        self.failed_ttl = float(failed_ttl)
+        # key -> (reading_id, replay_failed)
+        self._done = LRUTTLCache(maxsize, 0)
+        # 已失败的 reading_id
+        self._failed = LRUTTLCache(maxsize, 0)
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+        self.replayed = 0
+
+    @classmethod
+    def from_config(cls):
+        return cls(config.IDEMPOTENCY_CACHE_SIZE, config.SUBMIT_FLIGHT_WAIT, config.SUBMIT_DEDUPE_WINDOW)
+
+    def begin(self, key, ttl, replay_failed=False):
+        """
+        :param replay_failed: 记录已失败时是否仍返回该记录（客户端幂等键为 True，自动识别的重复提交为 False）
+        :return: (reading_id, flight)
+                 reading_id 不为空表示重复提交，直接返回该记录；
+                 否则调用方成为 leader，须在结束时调用 finish(flight, reading_id)
+                 ttl <= 0 时不做合并，返回 (None, None)
+        """
+        if ttl <= 0 or self._done.maxsize == 0:
+            return None, None
+        while True:
+            with self._lock:
+                done = self._done.get(key)
+                if done is not None:
+                    reading_id, replayable = done
+                    if replayable or reading_id not in self._failed:
+                        self.replayed += 1
+                        return reading_id, None
+                    # 之前的解读已失败，本次按新提交处理
+                    self._done.pop(key)
+                flight = self._flights.get(key)
+                if flight is None:
+                    flight = self._flights[key] = _Flight(key, ttl, replay_failed)
+                    return None, flight
+            if not flight.event.wait(self.flight_wait):
+                # leader 迟迟没有完成，不再等待，按新提交处理
+                return None, None
+            if flight.reading_id is not None:
+                with self._lock:
+                    self.coalesced += 1
+                return flight.reading_id, None
+
+    def finish(self, flight, reading_id):
+        """leader 结束：reading_id 为空表示创建失败"""
+        if flight is None:
+            return
+        with self._lock:
+            if reading_id is not None:
+                self._done.set(flight.key, (reading_id, flight.replay_failed), flight.ttl)
+            self._flights.pop(flight.key, None)
+        flight.reading_id = reading_id
+        flight.event.set()
+
+    def mark_failed(self, reading_id):
+        """解读失败：自动识别的重复提交不再合并到这条记录（可能早于 finish 调用）"""
+        if self.failed_ttl > 0:
+            self._failed.set(reading_id, True, self.failed_ttl)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'recent': len(self._done),
+                'coalesced': self.coalesced,
+                'replayed': self.replayed,
+            }
+
+
+# 全局共享的提交合并器
+submission_deduper = SubmissionDeduper.from_config()
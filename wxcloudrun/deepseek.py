@@ -1,11 +1,25 @@
+import hashlib
 import json
 import logging
+import os
+import random
 import re
+import threading
+import time
+import unicodedata
+
 import requests
+from requests.adapters import HTTPAdapter
+
 import config
+from wxcloudrun.jsonstream import IncrementalObjectParser
+from wxcloudrun.metrics import DEEPSEEK_LATENCY, DEEPSEEK_TOKENS, PARSE_RESULTS
 
 logger = logging.getLogger('log')
 
+# 可重试的 HTTP 状态码：限流与服务端临时错误
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
 RESULT_REQUIRED_KEYS = ["reading_content", "综合分析", "金句", "建议"]
 
 SYSTEM_PROMPT = """你是一位塔罗占卜师，请根据用户抽到的牌阵和牌面，生成个性化解读。
@@ -37,8 +51,77 @@ SYSTEM_PROMPT = """你是一位塔罗占卜师，请根据用户抽到的牌阵
    - 给出3条具体建议，每条带行动提示（如"写下来"、"尝试一次对话"）
    - 每条建议之间用换行分隔
 
+篇幅：按用户消息中的「篇幅要求」控制各部分字数，牌少时写得精炼，不要为凑字数重复内容。
+
 注意：避免术语堆砌，如"潜意识"、"能量场"等可用"内心声音"、"情绪流动"替代。不要使用任何emoji表情符号，用纯文字表达。"""
 
+# 用户消息模板：从各次调用间最稳定的部分排到最易变的部分（牌阵 → 篇幅 → 牌面 → 问题），
+# 使同一牌阵的请求在 System Prompt 之后还能继续命中上游的前缀缓存
+USER_TEMPLATE = """使用的牌阵：{spread}{positions}
+
+篇幅要求：{length}
+
+抽到的牌（按牌位顺序）：{cards}
+
+我的问题是：{question}
+
+请为我解读这些牌。"""
+
+# 篇幅档位：(每张牌解读字数, 综合分析字数, 每张牌的 max_tokens)
+# single=单张牌，small=2~4 张，large=5 张及以上
+LENGTH_TIERS = {
+    'single': ('200~300字', '120~200字', 500),
+    'small': ('100~150字', '150~250字', 300),
+    'large': ('60~90字', '200~300字', 250),
+}
+# 牌阵名称包含这些关键词时使用更精炼的档位（取与牌数档位中更精炼的一个）
+SPREAD_LENGTH_KEYWORDS = (
+    ('每日', 'small'),
+    ('今日', 'small'),
+    ('是否', 'small'),
+    ('凯尔特', 'large'),
+)
+_TIER_ORDER = ('single', 'small', 'large')
+
+
+def reading_budget(cards, spread):
+    """
+    根据牌数和牌阵类型确定篇幅要求与 max_tokens
+    :return: (篇幅要求文本, max_tokens)
+    """
+    count = max(1, len(cards))
+    tier = 'single' if count == 1 else ('small' if count <= 4 else 'large')
+    for keyword, keyword_tier in SPREAD_LENGTH_KEYWORDS:
+        if keyword in (spread or '') and _TIER_ORDER.index(keyword_tier) > _TIER_ORDER.index(tier):
+            tier = keyword_tier
+    per_card, analysis, tokens_per_card = LENGTH_TIERS[tier]
+    length = "每张牌的解读约{}，综合分析约{}，金句一句，建议3条每条不超过40字".format(per_card, analysis)
+    max_tokens = config.DEEPSEEK_MAX_TOKENS_BASE + tokens_per_card * count
+    return length, min(config.DEEPSEEK_MAX_TOKENS, max_tokens)
+
+
+def build_messages(question, cards, spread, positions=None):
+    """
+    组装对话消息：System Prompt 完全静态，所有随请求变化的内容都放在用户消息里
+    :return: (messages, max_tokens)
+    """
+    positions_str = ""
+    if positions and len(positions) == len(cards):
+        positions_str = f"\n各牌位含义（按顺序）：{'、'.join(positions)}"
+    length, max_tokens = reading_budget(cards, spread)
+    user_message = USER_TEMPLATE.format(
+        spread=spread,
+        positions=positions_str,
+        length=length,
+        cards="、".join(f"{name}牌{pos}位" for name, pos in cards.items()),
+        question=question,
+    )
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": user_message},
+    ]
+    return messages, max_tokens
+
 
 def parse_reading_result(raw_text):
     """
@@ -70,16 +153,21 @@ def parse_reading_result(raw_text):
     return False, text
 
 
+def _with_required_keys(data):
+    """补齐缺失的必要字段"""
+    for key in RESULT_REQUIRED_KEYS:
+        if key not in data:
+            data[key] = ""
+    return data
+
+
 def _try_parse_json(text):
     """尝试解析 JSON 并验证必要字段存在"""
     try:
         data = json.loads(text)
         if not isinstance(data, dict):
             return None
-        for key in RESULT_REQUIRED_KEYS:
-            if key not in data:
-                data[key] = ""
-        return data
+        return _with_required_keys(data)
     except (json.JSONDecodeError, TypeError):
         return None
 
@@ -100,13 +188,403 @@ def safe_parse_result(result_str):
     return {"reading_content": result_str, "综合分析": "", "金句": "", "建议": ""}
 
 
-def call_deepseek(question, cards, spread, positions=None):
+def normalize_reading_result(result_str):
+    """
+    将解读结果规范化为只含 RESULT_REQUIRED_KEYS 且值均为字符串的 dict
+    兼容旧的纯文本记录，以及大模型把建议等字段返回为数组的情况
+    """
+    data = safe_parse_result(result_str)
+    return {key: normalize_field(data.get(key, "")) for key in RESULT_REQUIRED_KEYS}
+
+
+def normalize_field(value):
+    """把单个字段的值规范化为字符串（数组按行拼接）"""
+    if isinstance(value, list):
+        return "\n".join(str(item) for item in value)
+    if value is None:
+        return ""
+    if not isinstance(value, str):
+        return str(value)
+    return value
+
+
+# 历史列表摘要的最大长度
+EXCERPT_MAX_LENGTH = 100
+
+
+def build_excerpt(result_obj):
+    """
+    从解读结果中提取历史列表展示用的摘要：优先使用金句，没有金句时截取牌面解读开头
+    """
+    if not result_obj:
+        return ""
+    text = (result_obj.get("金句") or result_obj.get("reading_content") or "").strip()
+    if len(text) > EXCERPT_MAX_LENGTH:
+        text = text[:EXCERPT_MAX_LENGTH - 1] + "…"
+    return text
+
+
+def _normalize_text(text):
+    """归一化用户输入：全角转半角、合并空白、去掉首尾空白和结尾标点"""
+    text = unicodedata.normalize('NFKC', text or '')
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text.rstrip('?？!！。.~～ ').lower()
+
+
+def build_cache_key(question, cards, spread, positions=None):
+    """
+    根据解读输入构造内容寻址的缓存键
+    牌的顺序与牌位一一对应，因此保留顺序；模型和提示词模板也参与计算，变更后旧缓存自动失效
+    """
+    material = {
+        'model': config.DEEPSEEK_MODEL,
+        'prompt': hashlib.sha256((SYSTEM_PROMPT + USER_TEMPLATE).encode('utf-8')).hexdigest()[:16],
+        'question': _normalize_text(question),
+        'cards': [[_normalize_text(name), _normalize_text(pos)] for name, pos in cards.items()],
+        'spread': _normalize_text(spread),
+        'positions': [_normalize_text(p) for p in positions] if positions and len(positions) == len(cards) else [],
+    }
+    raw = json.dumps(material, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class CircuitBreaker(object):
+    """
+    熔断器：连续失败 failure_threshold 次后打开，reset_timeout 秒内直接快速失败；
+    超时后进入半开状态放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def is_open(self):
+        """熔断器是否处于打开状态（不消耗半开探测名额）"""
+        return self.state == self.OPEN
+
+    def allow(self):
+        """当前是否允许发起请求"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+                self._probing = False
+            # 半开状态只放行一个探测请求
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def release(self):
+        """放弃本次请求（未真正发出，如限流超时）：归还半开探测名额，不计成功或失败"""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.error("DeepSeek 熔断器打开，连续失败 {} 次".format(self._failures))
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class RateLimiter(object):
+    """
+    大模型调用限流（进程内）
+    - 令牌桶：每秒补充 rate 个令牌，最多积累 burst 个，每次 HTTP 请求（含重试）消耗一个；rate<=0 表示不限速
+    - 并发上限：同时进行中的调用（含流式读取）不超过 max_inflight 个；<=0 表示不限制
+    获取不到令牌或并发名额时最多等待 acquire_timeout 秒
+    多实例部署时，账号级限额需按实例数平分后配置
+    """
+
+    def __init__(self, rate=0, burst=1, max_inflight=0, acquire_timeout=30):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.max_inflight = int(max_inflight)
+        self.acquire_timeout = float(acquire_timeout)
+        self._cond = threading.Condition()
+        self._tokens = self.burst
+        self._refilled_at = time.monotonic()
+        self._inflight = 0
+        self.throttled = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+
+    def _refill_locked(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def acquire_token(self):
+        """按令牌桶速率放行一次请求，超时返回 False"""
+        if self.rate <= 0:
+            return True
+        start = time.monotonic()
+        deadline = start + self.acquire_timeout
+        with self._cond:
+            self._refill_locked()
+            if self._tokens < 1:
+                self.throttled += 1
+            while self._tokens < 1:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    return False
+                self._cond.wait(min(remaining, (1 - self._tokens) / self.rate))
+                self._refill_locked()
+            self._tokens -= 1
+            self.wait_total += time.monotonic() - start
+            return True
+
+    def enter(self):
+        """占用一个并发名额，超时返回 False；成功后须调用 leave()"""
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._cond:
+            while 0 < self.max_inflight <= self._inflight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    return False
+                self._cond.wait(remaining)
+            self._inflight += 1
+            return True
+
+    def leave(self):
+        with self._cond:
+            self._inflight -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            self._refill_locked()
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'tokens': round(self._tokens, 2),
+                'max_inflight': self.max_inflight,
+                'inflight': self._inflight,
+                'throttled': self.throttled,
+                'timeouts': self.timeouts,
+                'wait_total_s': round(self.wait_total, 3),
+            }
+
+
+class DeepSeekClient(object):
+    """
+    可复用的 DeepSeek 客户端
+    - 持有带连接池的 requests.Session，复用 TCP/TLS 连接（fork 后自动重建）
+    - 连接超时与读取超时分开配置
+    - 对 429/5xx 及连接错误做带随机抖动的指数退避重试
+    - 上游持续故障时由熔断器快速失败
+    - 由 limiter 控制每秒请求数和并发调用数，避免触发上游 429
+    """
+
+    def __init__(self, api_url, pool_size=8, connect_timeout=3, read_timeout=60,
+                 max_retries=2, backoff_base=0.5, backoff_max=8, breaker=None, limiter=None):
+        self.api_url = api_url
+        self.pool_size = max(1, int(pool_size))
+        self.timeout = (float(connect_timeout), float(read_timeout))
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_base = float(backoff_base)
+        self.backoff_max = float(backoff_max)
+        self.breaker = breaker or CircuitBreaker()
+        self.limiter = limiter or RateLimiter()
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+
+    @classmethod
+    def from_config(cls):
+        return cls(
+            config.DEEPSEEK_API_URL,
+            pool_size=config.DEEPSEEK_POOL_SIZE,
+            connect_timeout=config.DEEPSEEK_CONNECT_TIMEOUT,
+            read_timeout=config.DEEPSEEK_READ_TIMEOUT,
+            max_retries=config.DEEPSEEK_MAX_RETRIES,
+            backoff_base=config.DEEPSEEK_BACKOFF_BASE,
+            backoff_max=config.DEEPSEEK_BACKOFF_MAX,
+            breaker=CircuitBreaker(config.DEEPSEEK_BREAKER_THRESHOLD, config.DEEPSEEK_BREAKER_RESET),
+            limiter=RateLimiter(config.LLM_RATE_LIMIT, config.LLM_RATE_BURST, config.LLM_MAX_INFLIGHT,
+                                config.LLM_ACQUIRE_TIMEOUT),
+        )
+
+    @property
+    def session(self):
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size,
+                                          pool_block=False, max_retries=0)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+                    self._pid = os.getpid()
+        return self._session
+
+    def warmup(self):
+        """预先建立到上游的 TCP/TLS 连接并留在连接池中（不计入熔断和限流）"""
+        try:
+            self.session.head(self.api_url, timeout=self.timeout)
+            return True
+        except requests.exceptions.RequestException as e:
+            logger.warning("DeepSeek 连接预热失败: {}".format(e))
+            return False
+
+    def _backoff(self, attempt, response=None):
+        """计算第 attempt 次重试前的等待时间（full jitter），优先遵循 Retry-After"""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def post(self, payload, headers, **kwargs):
+        """
+        发送请求，按需重试
+        :return: (success, message, response)
+                 success 为 False 时 response 可能为 None
+        """
+        if not self.breaker.allow():
+            return False, "AI 服务暂时不可用，请稍后重试", None
+
+        response = None
+        message = ""
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                time.sleep(self._backoff(attempt - 1, response))
+            response = None
+            if not self.limiter.acquire_token():
+                # 请求未发出：归还半开探测名额，否则熔断器会一直停在半开状态拒绝所有请求
+                self.breaker.release()
+                return False, "当前解读请求较多，请稍后再试", None
+            try:
+                response = self.session.post(self.api_url, headers=headers, json=payload,
+                                             timeout=self.timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout) as e:
+                logger.warning("DeepSeek API 连接失败 (第 {} 次): {}".format(attempt + 1, e))
+                message = "AI 服务连接失败，请稍后重试"
+                continue
+            except requests.exceptions.Timeout:
+                # 读取超时说明上游已接收请求，不再重试以免叠加等待
+                logger.error("DeepSeek API 请求超时")
+                self.breaker.record_failure()
+                return False, "AI 服务请求超时，请稍后重试", None
+            except requests.exceptions.RequestException as e:
+                logger.error(f"DeepSeek API 请求异常: {e}")
+                self.breaker.record_failure()
+                return False, f"AI 服务请求异常: {str(e)}", None
+
+            if response.status_code == 200:
+                self.breaker.record_success()
+                return True, "", response
+            if response.status_code not in RETRYABLE_STATUS:
+                # 4xx 等不可重试错误说明上游可用，不计入熔断
+                self.breaker.record_success()
+                logger.error(f"DeepSeek API 请求失败, status={response.status_code}, body={response.text}")
+                return False, f"AI 服务请求失败 (HTTP {response.status_code})", response
+            logger.warning("DeepSeek API 返回 {} (第 {} 次)".format(response.status_code, attempt + 1))
+            message = f"AI 服务请求失败 (HTTP {response.status_code})"
+            if attempt < self.max_retries:
+                # 流式请求的响应体不会被自动读取，重试前关闭以归还连接（最后一次保留，用于记录响应体）
+                response.close()
+
+        self.breaker.record_failure()
+        if response is not None:
+            logger.error(f"DeepSeek API 请求失败, status={response.status_code}, body={response.text}")
+        return False, message, response
+
+
+# 全局共享的 DeepSeek 客户端
+deepseek_client = DeepSeekClient.from_config()
+
+
+def _record_usage(usage):
+    """
+    记录 usage 中的 token 数
+    DeepSeek 以 prompt_cache_hit_tokens / prompt_cache_miss_tokens 返回前缀缓存命中情况，
+    OpenAI 兼容接口则使用 prompt_tokens_details.cached_tokens
+    """
+    if not usage:
+        return
+    for key in ('prompt_tokens', 'completion_tokens'):
+        value = usage.get(key)
+        if value:
+            DEEPSEEK_TOKENS.inc(key[:-len('_tokens')], amount=value)
+    hit = usage.get('prompt_cache_hit_tokens')
+    miss = usage.get('prompt_cache_miss_tokens')
+    if hit is None:
+        hit = (usage.get('prompt_tokens_details') or {}).get('cached_tokens')
+        if hit is not None and usage.get('prompt_tokens'):
+            miss = usage['prompt_tokens'] - hit
+    if hit:
+        DEEPSEEK_TOKENS.inc('cache_hit', amount=hit)
+    if miss:
+        DEEPSEEK_TOKENS.inc('cache_miss', amount=miss)
+
+
+def _read_stream(response, on_delta):
+    """
+    逐行读取 stream=true 的 SSE 响应，每收到一个文本片段就回调 on_delta
+    :return: (拼接后的完整回复文本, usage)，usage 在最后一个数据块中返回
+    """
+    usage = None
+    pieces = []
+    # 按字节逐行读取后再解码，避免响应头缺少 charset 时中文被截断或误解码
+    for line in response.iter_lines():
+        if not line or not line.startswith(b'data:'):
+            continue
+        data = line[5:].strip().decode('utf-8')
+        if data == '[DONE]':
+            break
+        chunk = json.loads(data)
+        usage = chunk.get("usage") or usage
+        choices = chunk.get("choices") or [{}]
+        delta = choices[0].get("delta", {}).get("content")
+        if delta:
+            pieces.append(delta)
+            on_delta(delta)
+    return ''.join(pieces), usage
+
+
+def call_deepseek(question, cards, spread, positions=None, on_delta=None, on_section=None):
     """
     调用 DeepSeek API 进行塔罗牌解读
     :param question: 用户的问题
     :param cards: 抽到的牌字典，格式 {"牌名": "正/负"}
     :param spread: 牌阵名称
     :param positions: 牌位含义列表，如 ["过去", "现在", "未来"]
+    :param on_delta: 流式回调（可选），传入时以 stream=true 调用，每收到一段文本调用一次
+    :param on_section: 字段回调（可选），传入时以 stream=true 调用，RESULT_REQUIRED_KEYS 中的字段
+                       一生成完毕就以 (key, value) 调用一次
     :return: (success, message, result_json_str)
              success: bool, 是否成功
              message: str, 提示信息
@@ -115,20 +593,13 @@ def call_deepseek(question, cards, spread, positions=None):
     if not config.DEEPSEEK_API_KEY:
         return False, "DeepSeek API Key 未配置", ""
 
-    cards_str = "、".join(f"{name}牌{pos}位" for name, pos in cards.items())
-
-    positions_str = ""
-    if positions and len(positions) == len(cards):
-        positions_str = f"\n\n各牌位含义（按顺序）：{'、'.join(positions)}"
-
-    user_message = f"""我的问题是：{question}
-
-使用的牌阵：{spread}{positions_str}
-
-抽到的牌（按牌位顺序）：{cards_str}
-
-请为我解读这些牌。"""
+    messages, max_tokens = build_messages(question, cards, spread, positions)
 
+    # 并发名额覆盖整个调用（流式模式下包括读取响应的过程）
+    if not deepseek_client.limiter.enter():
+        return False, "当前解读请求较多，请稍后再试", ""
+    start = time.monotonic()
+    outcome = 'error'
     try:
         headers = {
             "Content-Type": "application/json",
@@ -137,34 +608,53 @@ def call_deepseek(question, cards, spread, positions=None):
 
         payload = {
             "model": config.DEEPSEEK_MODEL,
-            "messages": [
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_message}
-            ],
+            "messages": messages,
             "temperature": 0.7,
-            "max_tokens": 2000
+            "max_tokens": max_tokens
         }
 
-        response = requests.post(
-            config.DEEPSEEK_API_URL,
-            headers=headers,
-            json=payload,
-            timeout=60
-        )
-
-        if response.status_code != 200:
-            logger.error(f"DeepSeek API 请求失败, status={response.status_code}, body={response.text}")
-            return False, f"AI 服务请求失败 (HTTP {response.status_code})", ""
+        parser = None
+        if on_delta is not None or on_section is not None:
+            payload["stream"] = True
+            payload["stream_options"] = {"include_usage": True}
+            ok, msg, response = deepseek_client.post(payload, headers, stream=True)
+            if not ok:
+                return False, msg, ""
+            # 边接收边解析，字段结束时立即回调，完整对象读完后无需再整体解析
+            parser = IncrementalObjectParser()
+
+            def handle_delta(delta):
+                if on_delta is not None:
+                    on_delta(delta)
+                for key, value in parser.feed(delta):
+                    if on_section is not None and key in RESULT_REQUIRED_KEYS:
+                        on_section(key, value)
+
+            with response:
+                raw_result, usage = _read_stream(response, handle_delta)
+            _record_usage(usage)
+            if not raw_result:
+                logger.error("DeepSeek API 流式返回内容为空")
+                return False, "AI 服务返回内容为空", ""
+        else:
+            ok, msg, response = deepseek_client.post(payload, headers)
+            if not ok:
+                return False, msg, ""
 
-        resp_data = response.json()
+            resp_data = response.json()
+            _record_usage(resp_data.get("usage"))
 
-        raw_result = resp_data.get("choices", [{}])[0].get("message", {}).get("content", "")
-        if not raw_result:
-            logger.error(f"DeepSeek API 返回内容为空, response={resp_data}")
-            return False, "AI 服务返回内容为空", ""
+            raw_result = resp_data.get("choices", [{}])[0].get("message", {}).get("content", "")
+            if not raw_result:
+                logger.error(f"DeepSeek API 返回内容为空, response={resp_data}")
+                return False, "AI 服务返回内容为空", ""
 
-        # 解析 JSON 结构
-        ok, parsed = parse_reading_result(raw_result)
+        # 解析 JSON 结构：流式模式下增量解析已得到完整对象时直接使用，否则整体解析
+        if parser is not None and parser.complete:
+            ok, parsed = True, _with_required_keys(parser.fields)
+        else:
+            ok, parsed = parse_reading_result(raw_result)
+        PARSE_RESULTS.inc('json' if ok else 'fallback')
         if ok:
             result_json_str = json.dumps(parsed, ensure_ascii=False)
         else:
@@ -172,14 +662,16 @@ def call_deepseek(question, cards, spread, positions=None):
             result_json_str = json.dumps(fallback, ensure_ascii=False)
             logger.warning("大模型返回格式异常，已使用 fallback 结构")
 
+        outcome = 'ok'
         return True, "解读成功", result_json_str
 
-    except requests.exceptions.Timeout:
-        logger.error("DeepSeek API 请求超时")
-        return False, "AI 服务请求超时，请稍后重试", ""
     except requests.exceptions.RequestException as e:
-        logger.error(f"DeepSeek API 请求异常: {e}")
-        return False, f"AI 服务请求异常: {str(e)}", ""
+        # 流式读取过程中连接中断
+        logger.error(f"DeepSeek API 流式读取异常: {e}")
+        return False, "AI 服务连接中断，请稍后重试", ""
     except (json.JSONDecodeError, KeyError, IndexError) as e:
         logger.error(f"DeepSeek API 响应解析失败: {e}")
         return False, "AI 服务响应解析失败", ""
+    finally:
+        deepseek_client.limiter.leave()
+        DEEPSEEK_LATENCY.observe(time.monotonic() - start, outcome)
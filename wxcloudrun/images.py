@@ -0,0 +1,291 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+import requests
+
+import config
+from wxcloudrun.lru import LRUTTLCache
+
+logger = logging.getLogger('log')
+
+# 防止路径遍历，只允许字母数字、中文、下划线、横线、点
+IMAGE_NAME_PATTERN = re.compile(r'^[\w\u4e00-\u9fff\-\.]+$')
+
+
+def normalize_image_name(name):
+    """
+    校验并规范化图片名称，无扩展名时补 .png
+    :return: 规范化后的名称，不合法时返回 None
+    """
+    name = (name or '').strip()
+    if not name or not IMAGE_NAME_PATTERN.match(name):
+        return None
+    if '.' not in name:
+        name = name + '.png'
+    return name
+
+
+# 启动时清单加载失败后的重试间隔（秒）
+RETRY_INTERVAL = 60
+
+
+class CardImageManifest(object):
+    """
+    塔罗牌图片清单
+    工作进程启动时加载对象存储列目录和打包的清单文件（card_manifest.json），并在后台线程中按 refresh_interval 定期刷新。
+    图片是否存在只以列目录为准；清单文件只提供整副牌的名称和顺序，其中的名称未经列目录或探测确认前不视为存在。
+    图片地址完全在内存中解析：未知名称直接返回默认图，并在后台核实一次，核实结果分别记入清单或负缓存。
+    列目录不可用时每 RETRY_INTERVAL 秒重试；两个来源都不可用时启动记录错误、预热视为失败，
+    期间所有名称返回默认图，请求路径上不做网络探测。
+    """
+
+    def __init__(self, base_url, default_image, manifest_file=None, refresh_interval=3600,
+                 negative_ttl=600, probe_timeout=3):
+        self.base_url = base_url.rstrip('/')
+        self.default_image = default_image
+        self.manifest_file = manifest_file
+        self.refresh_interval = float(refresh_interval)
+        self.probe_timeout = float(probe_timeout)
+        self._lock = threading.Lock()
+        self._names = frozenset()
+        # 整副牌的名称（清单文件中的顺序，列目录中多出的牌排在后面）与最近一次列目录的名称，
+        # 整副牌清单只依赖这两者，不受后台核实影响
+        self._deck = ()
+        self._catalog = frozenset()
+        self._file_deck = ()
+        self._listing = ()
+        self._loaded = False
+        self._source = None
+        self._loaded_at = None
+        self._misses = LRUTTLCache(10000, negative_ttl)
+        self._verifying = set()
+        self._refresher_pid = None
+        self._manifest = None
+        self.hits = 0
+        self.defaults = 0
+        self.probes = 0
+
+    @classmethod
+    def from_config(cls):
+        return cls(
+            config.STORAGE_BASE_URL,
+            config.STORAGE_DEFAULT_IMAGE,
+            manifest_file=config.STORAGE_MANIFEST_FILE,
+            refresh_interval=config.STORAGE_MANIFEST_REFRESH,
+            negative_ttl=config.STORAGE_NEGATIVE_TTL,
+        )
+
+    def url_for(self, name):
+        return "{}/{}".format(self.base_url, name)
+
+    @property
+    def default_url(self):
+        return self.url_for(self.default_image)
+
+    # ---------- 清单加载 ----------
+
+    def _load_from_file(self):
+        if not self.manifest_file or not os.path.exists(self.manifest_file):
+            return None
+        with open(self.manifest_file, encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            data = data.get('images', [])
+        return [n for n in (normalize_image_name(n) for n in data) if n]
+
+    def _load_from_listing(self):
+        """通过对象存储的列目录接口（ListBucketResult）获取全部文件名"""
+        names = []
+        marker = ''
+        while True:
+            resp = requests.get(self.base_url + '/', params={'marker': marker, 'max-keys': 1000},
+                                timeout=self.probe_timeout)
+            if resp.status_code != 200:
+                return None
+            root = ET.fromstring(resp.content)
+            ns = ''
+            if root.tag.startswith('{'):
+                ns = root.tag[:root.tag.index('}') + 1]
+            keys = [el.text for el in root.iter(ns + 'Key') if el.text]
+            names.extend(k for k in keys if '/' not in k and normalize_image_name(k) == k)
+            truncated = (root.findtext(ns + 'IsTruncated') or '').lower() == 'true'
+            if not truncated or not keys:
+                return names
+            marker = root.findtext(ns + 'NextMarker') or keys[-1]
+
+    def _load(self, source, loader):
+        try:
+            return loader()
+        except Exception as e:
+            logger.warning("加载图片清单失败, source={}, error={}".format(source, e))
+            return None
+
+    def refresh(self):
+        """
+        重新加载清单，失败的来源保留上一次的结果
+        :return: 是否已从列目录加载（只有列目录能确认图片存在）
+        """
+        deck = self._load('file', self._load_from_file)
+        listing = self._load('listing', self._load_from_listing)
+        with self._lock:
+            if deck:
+                self._file_deck = tuple(deck)
+            if listing:
+                self._listing = tuple(listing)
+                self._names = frozenset(listing) | {self.default_image}
+                self._catalog = self._names
+                self._source = 'listing'
+            elif deck and self._source is None:
+                # 列目录从未成功：只知道整副牌有哪些名称，图片按未知名称处理（默认图 + 后台核实）
+                self._names = self._names | {self.default_image}
+                self._source = 'file'
+            if deck or listing:
+                # 整副牌顺序以清单文件为准，列目录中清单文件没有的牌排在后面，两者各自保留上一次成功的结果
+                known = set(self._file_deck)
+                extra = tuple(n for n in self._listing if n not in known and n != self.default_image)
+                merged = self._file_deck + extra
+                if merged != self._deck:
+                    self._deck = merged
+                self._loaded = True
+                self._loaded_at = time.time()
+            source = self._source
+        if listing:
+            self._misses.clear()
+        if deck or listing:
+            logger.info("图片清单已加载, source={}, deck={}, listing={}".format(
+                source, len(deck or ()), len(listing) if listing else None))
+        return bool(listing) or self._source == 'listing'
+
+    def _refresh_loop(self, delay):
+        while True:
+            if delay:
+                time.sleep(delay)
+            listed = self.refresh()
+            delay = self.refresh_interval if listed else min(RETRY_INTERVAL, self.refresh_interval)
+
+    def start(self):
+        """
+        加载清单并启动后台刷新线程（每个进程一次，fork 后在子进程重新启动）
+        :return: 清单是否已加载
+        """
+        if self._refresher_pid == os.getpid():
+            return self._loaded
+        with self._lock:
+            if self._refresher_pid == os.getpid():
+                return self._loaded
+            self._refresher_pid = os.getpid()
+        # 同步请求一次列目录（整副牌一页即可列完），保证启动后解析出的地址都真实存在
+        listed = self.refresh()
+        loaded = self._loaded
+        if not loaded:
+            logger.error("图片清单不可用: 清单文件 {} 不存在或无效，对象存储列目录也失败；"
+                         "所有图片将返回默认图，{} 秒后重试".format(self.manifest_file, RETRY_INTERVAL))
+        elif not listed:
+            logger.warning("对象存储列目录失败，暂按清单文件的牌名逐个核实，{} 秒后重试".format(RETRY_INTERVAL))
+        delay = self.refresh_interval if listed else min(RETRY_INTERVAL, self.refresh_interval)
+        thread = threading.Thread(target=self._refresh_loop, args=(delay,), name='card-image-manifest')
+        thread.daemon = True
+        thread.start()
+        return loaded
+
+    # ---------- 名称解析 ----------
+
+    def _probe(self, name):
+        """HEAD 探测图片是否存在，结果写入清单或负缓存"""
+        self.probes += 1
+        try:
+            exists = requests.head(self.url_for(name), timeout=self.probe_timeout).status_code == 200
+        except Exception:
+            # 对象存储不可用时同样记入负缓存，避免每个请求都等待超时
+            exists = False
+        if exists:
+            with self._lock:
+                self._names = self._names | {name}
+        else:
+            self._misses.set(name, True)
+        return exists
+
+    def _verify_in_background(self, name):
+        with self._lock:
+            if name in self._verifying:
+                return
+            self._verifying.add(name)
+
+        def run():
+            try:
+                self._probe(name)
+            finally:
+                with self._lock:
+                    self._verifying.discard(name)
+
+        thread = threading.Thread(target=run, name='card-image-verify')
+        thread.daemon = True
+        thread.start()
+
+    def exists(self, name):
+        """判断规范化后的图片名是否存在"""
+        self.start()
+        if name in self._names:
+            self.hits += 1
+            return True
+        if name in self._misses:
+            self.defaults += 1
+            return False
+        self.defaults += 1
+        if self._loaded:
+            # 清单中没有：先返回默认图，后台核实是否为新上传的图片
+            self._verify_in_background(name)
+        return False
+
+    def resolve(self, name):
+        """
+        解析图片地址，不存在时返回默认图地址
+        :param name: 已规范化的图片名称
+        """
+        return self.url_for(name) if self.exists(name) else self.default_url
+
+    def manifest(self):
+        """
+        整副牌的图片清单：逐张给出地址，最近一次列目录中不存在的牌给出默认图地址
+        只由加载结果决定，清单未重新加载时内容和 ETag 不变
+        :return: (清单 dict, 强 ETag)，列目录尚未成功时返回 (None, None)，不发布未经确认的地址
+        """
+        with self._lock:
+            deck, catalog = self._deck, self._catalog
+        if not catalog:
+            return None, None
+        cached = self._manifest
+        if cached is not None and cached[0] is deck and cached[1] is catalog:
+            return cached[2], cached[3]
+        doc = {
+            'default_url': self.default_url,
+            'images': {name: self.url_for(name) if name in catalog else self.default_url for name in deck},
+        }
+        raw = json.dumps(doc, ensure_ascii=False, sort_keys=True).encode('utf-8')
+        etag = hashlib.sha256(raw).hexdigest()[:32]
+        self._manifest = (deck, catalog, doc, etag)
+        return doc, etag
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded': self._loaded,
+                'source': self._source,
+                'loaded_at': self._loaded_at,
+                'size': len(self._names),
+                'deck_size': len(self._deck),
+                'negative_size': len(self._misses),
+                'hits': self.hits,
+                'defaults': self.defaults,
+                'probes': self.probes,
+            }
+
+
+# 全局共享的图片清单
+card_images = CardImageManifest.from_config()
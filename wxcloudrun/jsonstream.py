@@ -0,0 +1,182 @@
+import json
+import re
+
+# 字符串内部只需关心引号和反斜杠
+_STRING_SPECIAL = re.compile(r'["\\]')
+_WHITESPACE = ' \t\r\n'
+
+# 解析状态
+_BEFORE_OBJECT = 0
+_EXPECT_KEY = 1
+_IN_KEY = 2
+_EXPECT_COLON = 3
+_EXPECT_VALUE = 4
+_IN_STRING_VALUE = 5
+_IN_RAW_VALUE = 6
+_EXPECT_COMMA = 7
+_DONE = 8
+
+
+class IncrementalObjectParser(object):
+    """
+    增量解析大模型流式输出的 JSON 对象，每个顶层字段的值结束时立即产出 (key, value)
+    - 跳过对象之前的任何内容（如 ```json 标记、说明文字），对象结束后的内容忽略
+    - 字符串值按 JSON 转义规则解码；数组、数字等其他值在括号配平后用 json.loads 解码
+    - 每个字符只扫描一次，总耗时与输出长度成正比
+    输出不是合法 JSON 时 failed 为 True，调用方应回退到整体解析
+    """
+
+    def __init__(self):
+        self._state = _BEFORE_OBJECT
+        self._buf = []
+        self._key = None
+        self._escaped = False
+        self._depth = 0
+        self._raw_in_string = False
+        self.fields = {}
+        self.failed = False
+
+    @property
+    def complete(self):
+        """是否已读到完整的顶层对象"""
+        return self._state == _DONE
+
+    def feed(self, text):
+        """
+        输入一段文本
+        :return: 本段文本中结束的字段 [(key, value), ...]
+        """
+        if self.failed or self._state == _DONE or not text:
+            return []
+        emitted = []
+        i, n = 0, len(text)
+        while i < n and not self.failed and self._state != _DONE:
+            state = self._state
+            if state in (_IN_KEY, _IN_STRING_VALUE):
+                i = self._scan_string(text, i, emitted)
+                continue
+            if state == _IN_RAW_VALUE:
+                i = self._scan_raw(text, i, emitted)
+                continue
+            ch = text[i]
+            i += 1
+            if state == _BEFORE_OBJECT:
+                if ch == '{':
+                    self._state = _EXPECT_KEY
+            elif ch in _WHITESPACE:
+                continue
+            elif state == _EXPECT_KEY:
+                if ch == '"':
+                    self._state = _IN_KEY
+                elif ch == '}':
+                    self._state = _DONE
+                else:
+                    self.failed = True
+            elif state == _EXPECT_COLON:
+                if ch == ':':
+                    self._state = _EXPECT_VALUE
+                else:
+                    self.failed = True
+            elif state == _EXPECT_VALUE:
+                if ch == '"':
+                    self._state = _IN_STRING_VALUE
+                else:
+                    self._state = _IN_RAW_VALUE
+                    self._depth = 0
+                    self._raw_in_string = False
+                    i -= 1
+            elif state == _EXPECT_COMMA:
+                if ch == ',':
+                    self._state = _EXPECT_KEY
+                elif ch == '}':
+                    self._state = _DONE
+                else:
+                    self.failed = True
+        return emitted
+
+    def _scan_string(self, text, i, emitted):
+        """扫描字符串直到结束引号，返回下一个未处理的位置"""
+        n = len(text)
+        while i < n:
+            if self._escaped:
+                # 转义符后的字符（\uXXXX 的十六进制位按普通字符处理）
+                self._buf.append(text[i])
+                self._escaped = False
+                i += 1
+                continue
+            match = _STRING_SPECIAL.search(text, i)
+            if match is None:
+                self._buf.append(text[i:])
+                return n
+            j = match.start()
+            self._buf.append(text[i:j])
+            if text[j] == '\\':
+                self._buf.append('\\')
+                self._escaped = True
+                i = j + 1
+                continue
+            self._close_string(emitted)
+            return j + 1
+        return n
+
+    def _close_string(self, emitted):
+        raw = ''.join(self._buf)
+        self._buf = []
+        try:
+            value = json.loads('"' + raw + '"')
+        except ValueError:
+            self.failed = True
+            return
+        if self._state == _IN_KEY:
+            self._key = value
+            self._state = _EXPECT_COLON
+        else:
+            self._emit(value, emitted)
+
+    def _scan_raw(self, text, i, emitted):
+        """扫描非字符串值（数组、对象、数字等），在同层的逗号或右括号处结束"""
+        n = len(text)
+        start = i
+        while i < n:
+            ch = text[i]
+            if self._raw_in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == '\\':
+                    self._escaped = True
+                elif ch == '"':
+                    self._raw_in_string = False
+            elif ch == '"':
+                self._raw_in_string = True
+            elif ch in '[{':
+                self._depth += 1
+            elif ch in ']}':
+                if self._depth == 0:
+                    # 外层对象的右括号：值结束，交给主循环处理
+                    self._buf.append(text[start:i])
+                    self._close_raw(emitted)
+                    return i
+                self._depth -= 1
+            elif ch == ',' and self._depth == 0:
+                self._buf.append(text[start:i])
+                self._close_raw(emitted)
+                return i
+            i += 1
+        self._buf.append(text[start:n])
+        return n
+
+    def _close_raw(self, emitted):
+        raw = ''.join(self._buf).strip()
+        self._buf = []
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            self.failed = True
+            return
+        self._emit(value, emitted)
+
+    def _emit(self, value, emitted):
+        self.fields[self._key] = value
+        emitted.append((self._key, value))
+        self._key = None
+        self._state = _EXPECT_COMMA
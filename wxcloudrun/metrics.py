@@ -0,0 +1,169 @@
+import bisect
+import threading
+
+# 请求耗时分桶（秒）：长轮询、SSE 请求会落在 30s 以上的桶
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 180)
+# 大模型调用耗时分桶（秒）
+LLM_BUCKETS = (0.5, 1, 2, 5, 10, 15, 20, 30, 45, 60, 90, 120)
+# 排队等待分桶（秒）
+QUEUE_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = ['{}="{}"'.format(n, _escape(v)) for n, v in zip(names, values)]
+    if extra:
+        pairs.append('{}="{}"'.format(extra[0], extra[1]))
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric(object):
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError("{} 需要标签 {}".format(self.name, self.labelnames))
+        return tuple(str(v) for v in labels)
+
+    def header(self):
+        return ['# HELP {} {}'.format(self.name, self.documentation),
+                '# TYPE {} {}'.format(self.name, self.kind)]
+
+
+class Counter(_Metric):
+    """只增计数器"""
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._children[key] = self._children.get(key, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._children.get(self._key(labels), 0)
+
+    def expose(self):
+        lines = self.header()
+        with self._lock:
+            items = sorted(self._children.items())
+        for key, value in items:
+            lines.append('{}{} {}'.format(self.name, _format_labels(self.labelnames, key), _format_value(value)))
+        return lines
+
+
+class Histogram(_Metric):
+    """分桶直方图，observe 时只做一次二分查找和几次加法"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=REQUEST_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                # [各桶计数..., +Inf 桶计数], 总和
+                child = self._children[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            child[0][index] += 1
+            child[1] += value
+
+    def expose(self):
+        lines = self.header()
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._children.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    self.name, _format_labels(self.labelnames, key, ('le', _format_value(float(bound)))), cumulative))
+            labels = _format_labels(self.labelnames, key)
+            lines.append('{}_sum{} {}'.format(self.name, labels, _format_value(total)))
+            lines.append('{}_count{} {}'.format(self.name, labels, cumulative))
+        return lines
+
+
+class GaugeFunc(_Metric):
+    """抓取时调用 fn() 取值的仪表（队列深度等瞬时值）"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, fn):
+        super(GaugeFunc, self).__init__(name, documentation)
+        self.fn = fn
+
+    def expose(self):
+        lines = self.header()
+        lines.append('{} {}'.format(self.name, _format_value(self.fn())))
+        return lines
+
+
+class Registry(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = []
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=REQUEST_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, fn):
+        return self.register(GaugeFunc(name, documentation, fn))
+
+    def expose(self):
+        """Prometheus 文本格式（0.0.4）"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+# 全局指标（每个进程独立累计）
+registry = Registry()
+
+REQUEST_LATENCY = registry.histogram(
+    'tarot_http_request_duration_seconds', '接口请求耗时', ('route', 'method', 'status'))
+DEEPSEEK_LATENCY = registry.histogram(
+    'tarot_deepseek_call_duration_seconds', 'DeepSeek 调用耗时（含重试和流式读取）', ('outcome',), LLM_BUCKETS)
+DEEPSEEK_TOKENS = registry.counter(
+    'tarot_deepseek_tokens_total', 'DeepSeek 返回的 usage token 数（含前缀缓存命中 cache_hit 与未命中 cache_miss）', ('type',))
+PARSE_RESULTS = registry.counter(
+    'tarot_reading_parse_total', '大模型回复解析结果，fallback 表示未能解析出 JSON', ('result',))
+QUEUE_WAIT = registry.histogram(
+    'tarot_reading_queue_wait_seconds', '解读任务从提交到开始执行的等待时间', (), QUEUE_BUCKETS)
+READINGS = registry.counter(
+    'tarot_readings_total', '解读任务结束时的状态', ('status',))
+SUBMISSIONS = registry.counter(
+    'tarot_reading_submissions_total', '解读任务提交结果', ('outcome',))
+ARCHIVED = registry.counter(
+    'tarot_readings_archived_total', '归档任务处理的记录数：deleted/expired=移入归档表，purged=从归档表清理', ('reason',))
@@ -0,0 +1,204 @@
+import hashlib
+import json
+import logging
+import time
+
+import pymysql
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn, CreateIndex, CreateTable
+
+import config
+from wxcloudrun import app, db
+from wxcloudrun.analytics import backfill_analytics
+from wxcloudrun.deepseek import safe_parse_result, normalize_reading_result, build_excerpt
+from wxcloudrun.model import TarotReading, SchemaMigration, china_now
+from wxcloudrun.response import make_tarot_result_payload
+
+logger = logging.getLogger('log')
+
+
+def ensure_database():
+    """确保 flask_demo 数据库使用 utf8mb4 字符集（部署时执行，不在导入时连接数据库）"""
+    if config.DATABASE_URL or db.engine.dialect.name != 'mysql':
+        return
+    if not config.db_address or not config.username:
+        logger.warning("数据库配置不完整，跳过自动创建数据库")
+        return
+    try:
+        host, port = config.db_address.split(':')
+        conn = pymysql.connect(
+            host=host,
+            port=int(port),
+            user=config.username,
+            password=config.password,
+            charset='utf8mb4'
+        )
+        cursor = conn.cursor()
+        cursor.execute("ALTER DATABASE flask_demo CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
+        conn.commit()
+        cursor.close()
+        conn.close()
+        logger.info("数据库 flask_demo 已就绪")
+    except Exception as e:
+        logger.error("自动创建数据库失败: {}".format(e))
+
+
+def schema_version():
+    """当前模型定义（建表语句 + 索引）的哈希，模型变化时版本随之变化"""
+    dialect = db.engine.dialect
+    ddl = []
+    for table in db.metadata.sorted_tables:
+        ddl.append(str(CreateTable(table).compile(dialect=dialect)))
+        for index in sorted(table.indexes, key=lambda ix: ix.name):
+            ddl.append(str(CreateIndex(index).compile(dialect=dialect)))
+    return hashlib.sha256('\n'.join(ddl).encode('utf-8')).hexdigest()
+
+
+def migrations_needed():
+    """
+    数据库中是否还没有记录当前结构版本（一次主键查询，不做表结构反射）
+    :return: 需要执行迁移时返回 True
+    """
+    try:
+        return db.session.query(SchemaMigration.version).filter(
+            SchemaMigration.version == schema_version()
+        ).first() is None
+    except Exception:
+        # schema_migrations 表不存在（首次部署或旧版本数据库）
+        db.session.rollback()
+        return True
+    finally:
+        db.session.remove()
+
+
+def ensure_columns():
+    """
+    为已存在的表补加模型中新增的列（ALTER TABLE ... ADD COLUMN）
+    :return: 新增的列名列表（table.column）
+    """
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {col['name'] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = CreateColumn(column).compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql('ALTER TABLE {} ADD COLUMN {}'.format(table.name, ddl))
+            added.append('{}.{}'.format(table.name, column.name))
+            logger.info("已新增列 {}.{}".format(table.name, column.name))
+    return added
+
+
+def ensure_indexes():
+    """
+    为已存在的表补建模型中声明、但数据库中缺失的索引
+    db.create_all() 只创建缺失的表，不会修改已有表
+    :return: 新建的索引名列表
+    """
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            index.create(bind=db.engine)
+            created.append(index.name)
+            logger.info("已创建索引 {}.{}".format(table.name, index.name))
+    return created
+
+
+def backfill_excerpts(batch_size=500):
+    """
+    为已完成但缺少摘要的旧记录补写 excerpt，按 id 分批处理
+    :return: 补写的记录数
+    """
+    total = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(TarotReading.id, TarotReading.result).filter(
+            TarotReading.id > last_id,
+            TarotReading.status == 'completed',
+            TarotReading.excerpt.is_(None)
+        ).order_by(TarotReading.id).limit(batch_size).all()
+        if not rows:
+            break
+        for reading_id, result in rows:
+            TarotReading.query.filter(TarotReading.id == reading_id).update(
+                {'excerpt': build_excerpt(safe_parse_result(result))}, synchronize_session=False
+            )
+        db.session.commit()
+        total += len(rows)
+        last_id = rows[-1][0]
+    if total:
+        logger.info("已为 {} 条旧记录补写摘要".format(total))
+    return total
+
+
+def backfill_result_payloads(batch_size=200):
+    """
+    将已完成的旧记录规范化：result 改写为标准 JSON，并补写摘要和预生成的响应体
+    兼容旧的纯文本格式记录，按 id 分批处理
+    :return: 处理的记录数
+    """
+    total = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(TarotReading.id, TarotReading.result).filter(
+            TarotReading.id > last_id,
+            TarotReading.status == 'completed',
+            TarotReading.result_payload.is_(None)
+        ).order_by(TarotReading.id).limit(batch_size).all()
+        if not rows:
+            break
+        for reading_id, result in rows:
+            doc = normalize_reading_result(result)
+            TarotReading.query.filter(TarotReading.id == reading_id).update({
+                'result': json.dumps(doc, ensure_ascii=False),
+                'excerpt': build_excerpt(doc),
+                'result_payload': make_tarot_result_payload(doc),
+            }, synchronize_session=False)
+        db.session.commit()
+        total += len(rows)
+        last_id = rows[-1][0]
+    if total:
+        logger.info("已为 {} 条旧记录生成结果响应体".format(total))
+    return total
+
+
+def run_migrations():
+    """
+    执行全部结构迁移，每一步都是幂等的，可重复执行
+    """
+    db.create_all()
+    ensure_columns()
+    ensure_indexes()
+    backfill_result_payloads()
+    backfill_excerpts()
+    backfill_analytics()
+    db.session.merge(SchemaMigration(version=schema_version(), applied_at=china_now()))
+    db.session.commit()
+
+
+def migrate():
+    """部署时执行：确认数据库字符集并完成全部结构迁移"""
+    with app.app_context():
+        ensure_database()
+        run_migrations()
+        return schema_version()
+
+
+@app.cli.command('migrate')
+def migrate_command():
+    """执行数据库结构迁移（flask migrate，等同于 python run.py migrate）"""
+    start = time.monotonic()
+    version = migrate()
+    print("迁移完成, version={}, 耗时 {:.0f} ms".format(version, (time.monotonic() - start) * 1000))
@@ -27,15 +27,109 @@ class User(db.Model):
 # 塔罗牌解读记录表
 class TarotReading(db.Model):
     __tablename__ = 'tarot_readings'
-    __table_args__ = {'mysql_charset': 'utf8mb4', 'mysql_collate': 'utf8mb4_unicode_ci'}
+    __table_args__ = (
+        # 历史记录按 (created_at, id) 游标分页
+        db.Index('idx_tarot_readings_history', 'openid', 'is_deleted', 'created_at', 'id'),
+        # 启动时按状态扫描未完成的任务
+        db.Index('idx_tarot_readings_status', 'status', 'created_at'),
+        # 归档任务按 id 顺序分批扫描已软删除的记录
+        db.Index('idx_tarot_readings_deleted', 'is_deleted', 'id'),
+        # 客户端幂等键在同一用户下唯一（NULL 不参与唯一约束）
+        db.Index('uq_tarot_readings_idempotency', 'openid', 'idempotency_key', unique=True),
+        {'mysql_charset': 'utf8mb4', 'mysql_collate': 'utf8mb4_unicode_ci'},
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     openid = db.Column(db.String(128), nullable=False, index=True, comment='用户微信openid')
     question = db.Column(db.String(500), nullable=False, comment='用户提问')
     cards = db.Column(db.String(500), nullable=False, comment='抽到的牌，JSON字符串')
     spread = db.Column(db.String(100), nullable=False, comment='牌阵名称')
+    positions = db.Column(db.String(500), nullable=True, comment='牌位含义，JSON字符串（任务重新入队时使用）')
+    idempotency_key = db.Column(db.String(64), nullable=True, comment='客户端提交的幂等键（Idempotency-Key）')
     # status: pending=等待解读, processing=解读中, completed=解读完成, failed=解读失败
     status = db.Column(db.String(20), nullable=False, default='pending', comment='任务状态')
     result = db.Column(db.Text, nullable=True, comment='大模型解读结果')
+    excerpt = db.Column(db.String(200), nullable=True, comment='解读摘要（金句），用于历史列表')
+    partial_result = db.Column(db.Text, nullable=True, comment='解读中已生成完毕的字段（JSON），状态变化时清空')
+    result_payload = db.Column(db.LargeBinary, nullable=True, comment='解读完成后的结果接口响应体（UTF-8 JSON）')
     is_deleted = db.Column(db.Boolean, nullable=False, default=False, server_default='0', comment='是否已删除（软删除）')
     created_at = db.Column(db.TIMESTAMP, nullable=False, default=china_now, comment='创建时间')
+    started_at = db.Column(db.TIMESTAMP, nullable=True, comment='最近一次进入 processing 的时间（执行租约起点）')
+
+
+# 解读记录归档表：已软删除、或超过保留期限的记录从 tarot_readings 移到这里
+# 不保留 result_payload（可由 result 重新生成）和幂等键
+class TarotReadingArchive(db.Model):
+    __tablename__ = 'tarot_readings_archive'
+    __table_args__ = (
+        db.Index('idx_tarot_readings_archive_openid', 'openid', 'created_at'),
+        # 按归档时间分批清理
+        db.Index('idx_tarot_readings_archive_archived', 'archived_at', 'id'),
+        {'mysql_charset': 'utf8mb4', 'mysql_collate': 'utf8mb4_unicode_ci'},
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False, comment='原 tarot_readings 记录ID')
+    openid = db.Column(db.String(128), nullable=False, comment='用户微信openid')
+    question = db.Column(db.String(500), nullable=False, comment='用户提问')
+    cards = db.Column(db.String(500), nullable=False, comment='抽到的牌，JSON字符串')
+    spread = db.Column(db.String(100), nullable=False, comment='牌阵名称')
+    positions = db.Column(db.String(500), nullable=True, comment='牌位含义，JSON字符串')
+    status = db.Column(db.String(20), nullable=False, comment='任务状态')
+    result = db.Column(db.Text, nullable=True, comment='大模型解读结果')
+    excerpt = db.Column(db.String(200), nullable=True, comment='解读摘要（金句）')
+    is_deleted = db.Column(db.Boolean, nullable=False, default=False, server_default='0', comment='归档前是否已软删除')
+    created_at = db.Column(db.TIMESTAMP, nullable=False, comment='创建时间')
+    archived_at = db.Column(db.TIMESTAMP, nullable=False, default=china_now, comment='归档时间')
+
+
+# 解读结果缓存表（相同问题 + 牌面 + 牌阵复用已生成的解读）
+class ReadingCache(db.Model):
+    __tablename__ = 'reading_cache'
+    __table_args__ = {'mysql_charset': 'utf8mb4', 'mysql_collate': 'utf8mb4_unicode_ci'}
+
+    cache_key = db.Column(db.String(64), primary_key=True, comment='输入归一化后的 sha256')
+    result = db.Column(db.Text, nullable=False, comment='解读结果 JSON 字符串')
+    hit_count = db.Column(db.Integer, nullable=False, default=0, server_default='0', comment='已复用次数')
+    created_at = db.Column(db.TIMESTAMP, nullable=False, default=china_now, comment='生成时间')
+
+
+# 统计汇总表：解读状态变化时增量累加，管理端看板只读这些表，不扫描 tarot_readings
+# 按状态变化发生的日期（北京时间）统计
+class AnalyticsDaily(db.Model):
+    __tablename__ = 'analytics_daily'
+    __table_args__ = {'mysql_charset': 'utf8mb4', 'mysql_collate': 'utf8mb4_unicode_ci'}
+
+    day = db.Column(db.Date, primary_key=True, comment='日期')
+    submitted = db.Column(db.Integer, nullable=False, default=0, server_default='0', comment='提交的解读数')
+    completed = db.Column(db.Integer, nullable=False, default=0, server_default='0', comment='完成的解读数')
+    failed = db.Column(db.Integer, nullable=False, default=0, server_default='0', comment='失败的解读数')
+    active_users = db.Column(db.Integer, nullable=False, default=0, server_default='0', comment='提交过解读的用户数')
+
+
+class AnalyticsDailySpread(db.Model):
+    __tablename__ = 'analytics_daily_spread'
+    __table_args__ = {'mysql_charset': 'utf8mb4', 'mysql_collate': 'utf8mb4_unicode_ci'}
+
+    day = db.Column(db.Date, primary_key=True, comment='日期')
+    spread = db.Column(db.String(100), primary_key=True, comment='牌阵名称')
+    submitted = db.Column(db.Integer, nullable=False, default=0, server_default='0', comment='提交的解读数')
+    completed = db.Column(db.Integer, nullable=False, default=0, server_default='0', comment='完成的解读数')
+    failed = db.Column(db.Integer, nullable=False, default=0, server_default='0', comment='失败的解读数')
+
+
+# 每日活跃用户去重表：插入成功（当天首次提交）时 analytics_daily.active_users 加一
+class AnalyticsDailyUser(db.Model):
+    __tablename__ = 'analytics_daily_users'
+    __table_args__ = {'mysql_charset': 'utf8mb4', 'mysql_collate': 'utf8mb4_unicode_ci'}
+
+    day = db.Column(db.Date, primary_key=True, comment='日期')
+    openid = db.Column(db.String(128), primary_key=True, comment='用户微信openid')
+
+
+# 已执行的结构迁移版本（模型定义的哈希），启动时版本一致即可跳过迁移
+class SchemaMigration(db.Model):
+    __tablename__ = 'schema_migrations'
+    __table_args__ = {'mysql_charset': 'utf8mb4', 'mysql_collate': 'utf8mb4_unicode_ci'}
+
+    version = db.Column(db.String(64), primary_key=True, comment='模型结构哈希')
+    applied_at = db.Column(db.TIMESTAMP, nullable=False, default=china_now, comment='执行时间')
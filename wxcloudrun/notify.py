@@ -0,0 +1,71 @@
+import threading
+import time
+
+# 没有等待者的状态记录保留时间（秒），覆盖“查库之后、开始等待之前”状态已变化的窗口
+DEFAULT_RETENTION = 60
+
+
+class _Entry(object):
+    __slots__ = ('status', 'updated_at', 'waiters')
+
+    def __init__(self):
+        self.status = None
+        self.updated_at = time.monotonic()
+        self.waiters = 0
+
+
+class ReadingNotifier(object):
+    """
+    进程内的解读状态变更通知
+    工作线程在状态变化时调用 notify()，长轮询请求通过 wait() 挂起，
+    状态变化后立即返回，不需要反复查询数据库。
+    """
+
+    def __init__(self, retention=DEFAULT_RETENTION):
+        self.retention = retention
+        self._cond = threading.Condition()
+        self._entries = {}
+
+    def notify(self, reading_id, status):
+        with self._cond:
+            entry = self._entries.get(reading_id)
+            if entry is None:
+                entry = self._entries[reading_id] = _Entry()
+            entry.status = status
+            entry.updated_at = time.monotonic()
+            if entry.waiters:
+                self._cond.notify_all()
+            self._evict_locked()
+
+    def wait(self, reading_id, known_status, timeout):
+        """
+        等待记录状态离开 known_status，最多等待 timeout 秒
+        :return: 变化后的状态；超时或本进程未收到通知时返回 None
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._evict_locked()
+            entry = self._entries.get(reading_id)
+            if entry is None:
+                entry = self._entries[reading_id] = _Entry()
+            entry.waiters += 1
+            try:
+                while entry.status in (None, known_status):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    self._cond.wait(remaining)
+                return entry.status
+            finally:
+                entry.waiters -= 1
+
+    def _evict_locked(self):
+        now = time.monotonic()
+        expired = [rid for rid, e in self._entries.items()
+                   if not e.waiters and now - e.updated_at > self.retention]
+        for rid in expired:
+            del self._entries[rid]
+
+    def __len__(self):
+        with self._cond:
+            return len(self._entries)
@@ -0,0 +1,198 @@
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import g, request
+
+# 采样方式
+# cprofile: 对被采样的请求开启 cProfile，按路由累计 pstats（同一时刻只分析一个请求）
+# sample: 后台线程按 interval 抓取被采样请求所在线程的调用栈，按路由累计 collapsed stack（可直接生成火焰图）
+MODE_CPROFILE = 'cprofile'
+MODE_SAMPLE = 'sample'
+
+FORMAT_PSTATS = 'pstats'
+FORMAT_RAW = 'raw'
+FORMAT_COLLAPSED = 'collapsed'
+
+
+def _frame_label(code):
+    return '{}:{}'.format(os.path.basename(code.co_filename), code.co_name)
+
+
+class RequestProfiler(object):
+    """
+    按比例采样请求的性能分析钩子
+    只有 sample_rate > 0 时才注册请求钩子，关闭时请求路径上没有任何额外开销
+    """
+
+    def __init__(self, sample_rate=0.0, mode=MODE_CPROFILE, interval=0.005, routes=None):
+        if mode not in (MODE_CPROFILE, MODE_SAMPLE):
+            raise ValueError("未知的采样方式: {}".format(mode))
+        self.sample_rate = float(sample_rate)
+        self.mode = mode
+        self.interval = float(interval)
+        self.routes = frozenset(routes) if routes else None
+        self._lock = threading.Lock()
+        # cProfile 同一时刻只能在一个线程中启用
+        self._profiling = threading.Lock()
+        self._stats = {}
+        self._stacks = {}
+        self._samples = Counter()
+        self._targets = {}
+        self._targets_cond = threading.Condition()
+        self._sampler_pid = None
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0
+
+    def install(self, app):
+        """在 Flask app 上注册采样钩子（未开启时不注册）"""
+        if not self.enabled:
+            return
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    # ---------- 请求钩子 ----------
+
+    def _route(self):
+        return request.url_rule.rule if request.url_rule is not None else None
+
+    def _before_request(self):
+        route = self._route()
+        if route is None or (self.routes is not None and route not in self.routes):
+            return
+        if random.random() >= self.sample_rate:
+            return
+        if self.mode == MODE_CPROFILE:
+            if not self._profiling.acquire(blocking=False):
+                # 已有请求在分析，本次跳过
+                return
+            profile = cProfile.Profile()
+            g.profiler_state = (route, profile)
+            profile.enable()
+        else:
+            self._start_sampler()
+            with self._targets_cond:
+                self._targets[threading.get_ident()] = route
+                self._targets_cond.notify()
+            g.profiler_state = (route, None)
+
+    def _teardown_request(self, exc=None):
+        state = g.pop('profiler_state', None)
+        if state is None:
+            return
+        route, profile = state
+        if profile is not None:
+            profile.disable()
+            self._profiling.release()
+            with self._lock:
+                if route in self._stats:
+                    self._stats[route].add(profile)
+                else:
+                    self._stats[route] = pstats.Stats(profile)
+                self._samples[route] += 1
+        else:
+            with self._targets_cond:
+                self._targets.pop(threading.get_ident(), None)
+            with self._lock:
+                self._samples[route] += 1
+
+    # ---------- 调用栈采样 ----------
+
+    def _start_sampler(self):
+        if self._sampler_pid == os.getpid():
+            return
+        with self._lock:
+            if self._sampler_pid == os.getpid():
+                return
+            self._sampler_pid = os.getpid()
+        thread = threading.Thread(target=self._sample_loop, name='request-profiler')
+        thread.daemon = True
+        thread.start()
+
+    def _sample_loop(self):
+        while True:
+            with self._targets_cond:
+                while not self._targets:
+                    self._targets_cond.wait()
+                targets = dict(self._targets)
+            frames = sys._current_frames()
+            collected = []
+            for ident, route in targets.items():
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                if stack:
+                    collected.append((route, ';'.join(reversed(stack))))
+            with self._lock:
+                for route, stack in collected:
+                    self._stacks.setdefault(route, Counter())[stack] += 1
+            time.sleep(self.interval)
+
+    # ---------- 导出 ----------
+
+    def summary(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'mode': self.mode,
+                'sample_rate': self.sample_rate,
+                'routes': dict(self._samples),
+            }
+
+    def dump(self, route=None, fmt=FORMAT_PSTATS, limit=50, sort='cumulative'):
+        """
+        导出采样结果
+        :param route: 路由模板，为空时合并全部路由
+        :param fmt: pstats=文本报表，raw=pstats 二进制（可用 snakeviz 等工具打开），collapsed=折叠调用栈
+        :return: (内容, mimetype)；没有数据或格式与采样方式不匹配时返回 (None, 错误信息)
+        """
+        with self._lock:
+            if fmt == FORMAT_COLLAPSED:
+                if self.mode != MODE_SAMPLE:
+                    return None, 'collapsed 格式需要 PROFILE_MODE=sample'
+                counters = [c for r, c in self._stacks.items() if route is None or r == route]
+                if not counters:
+                    return None, '没有采样数据'
+                merged = Counter()
+                for counter in counters:
+                    merged.update(counter)
+                body = '\n'.join('{} {}'.format(stack, count) for stack, count in merged.most_common())
+                return body + '\n', 'text/plain'
+
+            if self.mode != MODE_CPROFILE:
+                return None, '{} 格式需要 PROFILE_MODE=cprofile'.format(fmt)
+            selected = [s for r, s in self._stats.items() if route is None or r == route]
+            if not selected:
+                return None, '没有采样数据'
+            # 合并到新的 Stats，不修改累计中的数据
+            stats = pstats.Stats()
+            for item in selected:
+                stats.add(item)
+
+        if fmt == FORMAT_RAW:
+            return marshal.dumps(stats.stats), 'application/octet-stream'
+        out = io.StringIO()
+        stats.stream = out
+        try:
+            stats.sort_stats(sort)
+        except KeyError:
+            return None, 'sort 参数不正确'
+        stats.print_stats(limit)
+        return out.getvalue(), 'text/plain'
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._stacks.clear()
+            self._samples.clear()
@@ -1,32 +1,118 @@
 import json
+import os
+import re
+from datetime import datetime, date
 
 from flask import Response
 
+import config
+
+# 可选依赖：安装了 orjson 时使用 orjson 序列化，否则使用标准库 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if config.JSON_BACKEND == 'json':
+    orjson = None
+
+JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+
+# 接口中日期时间的统一格式
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# RawJSON 序列化时的占位符标记（Unicode 私用区字符，两种后端都原样输出）
+_RAW_MARK = '\ue000'
+
+
+class RawJSON(object):
+    """已序列化的 JSON 文本（如数据库中存储的规范化结果），dumps 时原样嵌入，不再解析和重新序列化"""
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+
+def _default(obj):
+    if isinstance(obj, datetime):
+        return obj.strftime(DATETIME_FORMAT)
+    if isinstance(obj, date):
+        return obj.strftime('%Y-%m-%d')
+    if isinstance(obj, (bytes, bytearray)):
+        return obj.decode('utf-8')
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME
+
+    def _serialize(obj, default):
+        return orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS)
+else:
+    def _serialize(obj, default):
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=default).encode('utf-8')
+
+
+def dumps(obj):
+    """
+    序列化为 UTF-8 JSON 字节（中文不转义，datetime 按 DATETIME_FORMAT 输出）
+    RawJSON 先序列化为带随机串的占位字符串，最后替换为原始文本
+    """
+    raws = []
+    nonce = []
+
+    def default(value):
+        if isinstance(value, RawJSON):
+            if not nonce:
+                nonce.append(os.urandom(6).hex())
+            raws.append(value.text)
+            return '{0}{1}:{2}{0}'.format(_RAW_MARK, nonce[0], len(raws) - 1)
+        return _default(value)
+
+    body = _serialize(obj, default)
+    if not raws:
+        return body
+    mark = _RAW_MARK.encode('utf-8')
+    pattern = re.compile(b'"' + mark + nonce[0].encode('ascii') + b':(\\d+)' + mark + b'"')
+    return pattern.sub(lambda m: raws[int(m.group(1))].encode('utf-8'), body)
+
+
+def make_json_response(obj, status=200):
+    return Response(dumps(obj), status=status, mimetype='application/json')
+
 
 def make_succ_empty_response():
-    data = json.dumps({'code': 0, 'data': {}})
-    return Response(data, mimetype='application/json')
+    return make_json_response({'code': 0, 'data': {}})
 
 
 def make_succ_response(data):
-    data = json.dumps({'code': 0, 'data': data})
-    return Response(data, mimetype='application/json')
+    return make_json_response({'code': 0, 'data': data})
 
 
 def make_err_response(err_msg):
-    data = json.dumps({'code': -1, 'errorMsg': err_msg})
-    return Response(data, mimetype='application/json')
+    return make_json_response({'code': -1, 'errorMsg': err_msg})
 
 
 # ============ 塔罗牌解读专用响应 ============
 
 def make_tarot_succ_response(msg, result):
     """塔罗牌解读成功响应"""
-    data = json.dumps({'code': 0, 'msg': msg, 'result': result}, ensure_ascii=False)
-    return Response(data, mimetype='application/json')
+    return make_json_response({'code': 0, 'msg': msg, 'result': result})
 
 
 def make_tarot_err_response(msg):
     """塔罗牌解读失败响应"""
-    data = json.dumps({'code': 1, 'msg': msg, 'result': ''}, ensure_ascii=False)
-    return Response(data, mimetype='application/json')
+    return make_json_response({'code': 1, 'msg': msg, 'result': ''})
+
+
+def make_tarot_result_payload(result):
+    """
+    解读完成时预先生成 /api/tarot/result 的响应体（UTF-8 字节），存库后查询时直接返回
+    :param result: 规范化后的解读结果 dict
+    """
+    return dumps({
+        'code': 0,
+        'status': 'completed',
+        'msg': '解读成功',
+        'result': result
+    })
@@ -0,0 +1,111 @@
+import threading
+import time
+
+# 解读结束后流缓冲区的保留时间（秒），用于断线重连的客户端继续读取
+DEFAULT_RETENTION = 120
+
+
+class ReadingStream(object):
+    """
+    单条解读的流式输出缓冲区
+    工作线程不断追加大模型输出的文本片段，SSE 连接按字符偏移量读取，
+    断线重连时从上次收到的偏移量继续。
+    未正常结束就被关闭（closed）时，读取方应改为从数据库查询最终状态。
+    """
+
+    def __init__(self, reading_id):
+        self.reading_id = reading_id
+        self._cond = threading.Condition()
+        self._parts = []
+        self._length = 0
+        self.done = False
+        self.closed = False
+        self.status = None
+        self.result = None
+        self.finished_at = None
+
+    def append(self, text):
+        if not text:
+            return
+        with self._cond:
+            self._parts.append(text)
+            self._length += len(text)
+            self._cond.notify_all()
+
+    def finish(self, status, result=None):
+        with self._cond:
+            self.done = True
+            self.status = status
+            self.result = result
+            self.finished_at = time.monotonic()
+            self._cond.notify_all()
+
+    def close(self):
+        """任务不会在本进程结束（退回 pending、被其他线程接管），唤醒等待中的读取方"""
+        with self._cond:
+            self.closed = True
+            self.finished_at = time.monotonic()
+            self._cond.notify_all()
+
+    def read(self, offset, timeout=None):
+        """
+        读取 offset 之后的文本，没有新内容时最多等待 timeout 秒
+        :return: (text, new_offset, done)
+        """
+        with self._cond:
+            if self._length <= offset and not self.done and not self.closed and timeout:
+                self._cond.wait_for(lambda: self._length > offset or self.done or self.closed, timeout)
+            if self._length <= offset:
+                return '', offset, self.done
+            text = ''.join(self._parts)
+            # 合并片段，避免多次重连后反复拼接
+            self._parts = [text]
+            return text[offset:], self._length, self.done
+
+
+class StreamRegistry(object):
+    """进程内的解读流注册表，按 reading_id 查找；已结束的流保留 retention 秒后清理"""
+
+    def __init__(self, retention=DEFAULT_RETENTION):
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._streams = {}
+
+    def open(self, reading_id):
+        with self._lock:
+            self._evict_locked()
+            stream = self._streams.get(reading_id)
+            if stream is None:
+                stream = ReadingStream(reading_id)
+                self._streams[reading_id] = stream
+            return stream
+
+    def finish(self, reading_id, status, result=None):
+        """结束已创建的流缓冲区（任务未进入工作线程就已结束时调用）"""
+        with self._lock:
+            stream = self._streams.get(reading_id)
+        if stream is not None:
+            stream.finish(status, result)
+
+    def discard(self, reading_id):
+        """移除并关闭流缓冲区（任务不会在本进程结束时调用）"""
+        with self._lock:
+            stream = self._streams.pop(reading_id, None)
+        if stream is not None:
+            stream.close()
+
+    def get(self, reading_id):
+        with self._lock:
+            self._evict_locked()
+            return self._streams.get(reading_id)
+
+    def _evict_locked(self):
+        now = time.monotonic()
+        expired = [rid for rid, s in self._streams.items()
+                   if s.done and now - s.finished_at > self.retention]
+        for rid in expired:
+            del self._streams[rid]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._streams)
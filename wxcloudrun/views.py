@@ -1,24 +1,99 @@
+import hmac
 import json
 import logging
-import re
+import os
 import threading
+import time
+from datetime import timedelta
 
-import requests
-from flask import render_template, request, Response
+from flask import render_template, request, Response, stream_with_context, g
+from sqlalchemy import func
 
 import config
 from run import app
 from wxcloudrun import db
-from wxcloudrun.dao import insert_tarot_reading, query_readings_by_openid, update_tarot_reading, \
-    query_tarot_reading_by_id, soft_delete_reading, soft_delete_all_readings, \
-    get_or_create_user, update_user, query_user_by_openid
+from wxcloudrun.dao import insert_tarot_reading, query_readings_by_openid, transition_tarot_reading, \
+    query_tarot_reading_by_id, query_tarot_reading_state, query_pending_readings, query_readings_by_cursor, decode_history_cursor, \
+    soft_delete_reading, soft_delete_all_readings, query_reading_by_idempotency_key, save_partial_result, \
+    reclaim_stale_readings, \
+    get_or_create_user, ensure_user, update_user, query_user_by_openid
 from wxcloudrun.model import TarotReading, china_now
 from wxcloudrun.response import make_succ_empty_response, make_succ_response, make_err_response, \
-    make_tarot_succ_response, make_tarot_err_response
-from wxcloudrun.deepseek import call_deepseek, safe_parse_result
+    make_tarot_succ_response, make_tarot_err_response, make_tarot_result_payload, make_json_response, dumps, RawJSON
+from wxcloudrun.analytics import analytics, query_dashboard, query_total_submitted
+from wxcloudrun.archive import start_archiver, stop_archiver
+from wxcloudrun.bootstrap import warmup, readiness
+from wxcloudrun.cache import call_deepseek_cached, interpretation_cache
+from wxcloudrun.dbpool import describe_pool
+from wxcloudrun.dedupe import submission_deduper
+from wxcloudrun.deepseek import safe_parse_result, normalize_reading_result, normalize_field, build_excerpt, \
+    build_cache_key, deepseek_client, RESULT_REQUIRED_KEYS
+from wxcloudrun.images import card_images, normalize_image_name
+from wxcloudrun.metrics import registry, REQUEST_LATENCY, QUEUE_WAIT, READINGS, SUBMISSIONS
+from wxcloudrun.notify import ReadingNotifier
+from wxcloudrun.profiling import RequestProfiler
+from wxcloudrun.stream import StreamRegistry
+from wxcloudrun.worker import ReadingWorkerPool, SUBMIT_REJECTED
+
+# 重复提交被合并到已有记录（SUBMISSIONS 指标的 outcome 标签）
+SUBMIT_DEDUPLICATED = 'deduplicated'
 
 logger = logging.getLogger('log')
 
+# 解读任务线程池（工作线程在首次提交时才启动）
+reading_pool = ReadingWorkerPool(
+    max_workers=config.READING_WORKERS,
+    queue_size=config.READING_QUEUE_SIZE,
+    overflow_policy=config.READING_OVERFLOW_POLICY,
+    backlog_size=config.READING_BACKLOG_SIZE,
+    on_wait=QUEUE_WAIT.observe
+)
+
+# 进程内的流式输出缓冲区，供 /api/tarot/stream 读取
+reading_streams = StreamRegistry(retention=config.STREAM_RETENTION)
+
+# 进程内的状态变更通知，供 /api/tarot/result 长轮询等待
+reading_notifier = ReadingNotifier()
+
+
+def _queue_depth():
+    stats = reading_pool.stats()
+    return stats['queue_depth'] + stats['backlog_depth']
+
+
+registry.gauge('tarot_reading_queue_depth', '等待执行的解读任务数（含溢出队列）', _queue_depth)
+registry.gauge('tarot_reading_busy_workers', '正在执行解读任务的工作线程数',
+               lambda: reading_pool.stats()['busy_workers'])
+registry.gauge('tarot_deepseek_inflight', '进行中的 DeepSeek 调用数',
+               lambda: deepseek_client.limiter.stats()['inflight'])
+registry.gauge('tarot_deepseek_circuit_open', 'DeepSeek 熔断器是否打开',
+               lambda: 1 if deepseek_client.breaker.is_open() else 0)
+
+
+# 请求采样性能分析（PROFILE_SAMPLE_RATE > 0 时才注册钩子）
+request_profiler = RequestProfiler(
+    sample_rate=config.PROFILE_SAMPLE_RATE,
+    mode=config.PROFILE_MODE,
+    interval=config.PROFILE_INTERVAL,
+    routes=config.PROFILE_ROUTES
+)
+request_profiler.install(app)
+
+
+@app.before_request
+def _start_timer():
+    g.request_started_at = time.perf_counter()
+
+
+@app.after_request
+def _observe_latency(response):
+    """按路由模板（而非实际 URL）记录耗时，避免标签数量膨胀；SSE 只统计到开始推送为止"""
+    started = g.get('request_started_at')
+    if started is not None and config.METRICS_ENABLED:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_LATENCY.observe(time.perf_counter() - started, route, request.method, response.status_code)
+    return response
+
 
 @app.route('/')
 def index():
@@ -31,25 +106,74 @@ def index():
 def _process_tarot_reading(app_context, reading_id, question, cards, spread, positions=None):
     """
     后台线程：调用 DeepSeek 解读并将结果存入数据库
+    状态迁移均为 compare-and-set，记录已被其他线程处理时直接放弃
+    开启流式模式时，大模型输出的文本片段同步写入流缓冲区
+    开启部分结果时，每个字段生成完毕就写入 partial_result，供轮询接口提前返回
     """
+    stream = None
+    status, final_result = 'failed', '解读过程发生异常'
     with app_context:
         try:
-            update_tarot_reading(reading_id, 'processing')
-
-            success, msg, result = call_deepseek(question, cards, spread, positions)
+            if not transition_tarot_reading(reading_id, 'pending', 'processing'):
+                # 记录已被其他工作线程（或其他实例的恢复任务）领取，或已不存在
+                status = None
+                # 提交时创建的流缓冲区不会再由本进程结束：关闭它，SSE 连接改为查询数据库
+                # 本进程中另有线程正在执行同一记录时（计数含当前线程）保留，由那个线程结束
+                if config.DEEPSEEK_STREAM and reading_pool.running(reading_id) <= 1:
+                    reading_streams.discard(reading_id)
+                return
+            reading_notifier.notify(reading_id, 'processing')
+            # 领取成功后才创建流缓冲区，未领取的重复任务不会留下无人结束的缓冲区
+            stream = reading_streams.open(reading_id) if config.DEEPSEEK_STREAM else None
+
+            on_delta = stream.append if stream is not None else None
+            sections = {}
+
+            def on_section(key, value):
+                # 最后一个字段结束时紧接着就是完成状态，无需再单独保存
+                sections[key] = normalize_field(value)
+                if len(sections) < len(RESULT_REQUIRED_KEYS):
+                    save_partial_result(reading_id, json.dumps(sections, ensure_ascii=False))
+
+            success, msg, result = call_deepseek_cached(
+                question, cards, spread, positions, on_delta=on_delta,
+                on_section=on_section if config.PARTIAL_RESULTS else None
+            )
 
             if success:
-                update_tarot_reading(reading_id, 'completed', result)
-                logger.info("塔罗解读完成, id={}, 结果长度={}".format(reading_id, len(result)))
+                # 完成时一次性规范化，并预先生成结果接口的响应体
+                doc = normalize_reading_result(result)
+                result = json.dumps(doc, ensure_ascii=False)
+                if transition_tarot_reading(reading_id, 'processing', 'completed', result,
+                                            excerpt=build_excerpt(doc), payload=make_tarot_result_payload(doc)):
+                    status, final_result = 'completed', result
+                    logger.info("塔罗解读完成, id={}, 结果长度={}".format(reading_id, len(result)))
+                else:
+                    status = None
             else:
-                update_tarot_reading(reading_id, 'failed', msg)
+                if not transition_tarot_reading(reading_id, 'processing', 'failed', msg):
+                    status = None
+                final_result = msg
                 logger.error("塔罗解读失败, id={}, msg={}".format(reading_id, msg))
         except Exception as e:
             logger.error("塔罗解读异常, id={}, error={}".format(reading_id, str(e)))
             try:
-                update_tarot_reading(reading_id, 'failed', '解读过程发生异常')
+                transition_tarot_reading(reading_id, ('pending', 'processing'), 'failed', '解读过程发生异常')
             except Exception:
                 pass
+        finally:
+            # 先落库再通知，保证被唤醒的请求和重连的客户端总能从数据库读到最终结果
+            if status is not None:
+                READINGS.inc(status)
+                analytics.record_finished(spread, status)
+                if status == 'failed':
+                    submission_deduper.mark_failed(reading_id)
+                reading_notifier.notify(reading_id, status)
+                if stream is not None:
+                    stream.finish(status, final_result)
+            elif stream is not None:
+                # 最终状态迁移失败（租约过期被接管、记录已删除）：关闭缓冲区，SSE 连接改为查询数据库
+                reading_streams.discard(reading_id)
 
 
 @app.route('/api/tarot', methods=['POST'])
@@ -77,113 +201,392 @@ def tarot_reading():
     if not spread:
         return make_tarot_err_response('缺少牌阵(spread)参数')
 
-    get_or_create_user(openid)
+    idempotency_key = (request.headers.get('Idempotency-Key') or params.get('idempotency_key') or '').strip()
+    if len(idempotency_key) > 64:
+        return make_tarot_err_response('Idempotency-Key 长度不能超过64个字符')
+
+    # 重复提交（双击、客户端重试）合并到同一条记录，不重复调用大模型
+    # 带幂等键时按幂等键识别，否则按短时间窗口内相同的（问题、牌面、牌阵、牌位）识别
+    if idempotency_key:
+        dedupe_key = ('key', openid, idempotency_key)
+        ttl = config.IDEMPOTENCY_KEY_TTL
+    else:
+        dedupe_key = ('auto', openid, build_cache_key(question, cards, spread, positions))
+        ttl = config.SUBMIT_DEDUPE_WINDOW
+    # 自动识别的重复提交不返回已失败的记录，用户可以立即重试；带幂等键的重试始终返回首次创建的记录
+    reading_id, flight = submission_deduper.begin(dedupe_key, ttl, replay_failed=bool(idempotency_key))
+    if reading_id is not None:
+        return _submitted_response(reading_id, deduplicated=True)
+
+    reading_id = None
+    try:
+        reading_id, response = _create_tarot_reading(openid, question, cards, spread, positions, idempotency_key)
+        return response
+    finally:
+        submission_deduper.finish(flight, reading_id)
+
+
+def _submitted_response(reading_id, deduplicated=False):
+    """提交成功的响应；deduplicated 表示复用了已有的提交"""
+    if deduplicated:
+        SUBMISSIONS.inc(SUBMIT_DEDUPLICATED)
+    return make_json_response({
+        'code': 0,
+        'msg': '已提交解读，请稍候查询结果',
+        'reading_id': reading_id,
+        'queue_position': reading_pool.position(reading_id),
+        'deduplicated': deduplicated
+    })
+
+
+def _create_tarot_reading(openid, question, cards, spread, positions, idempotency_key):
+    """
+    写入解读记录并提交到线程池
+    :return: (reading_id, response)，未创建新任务时 reading_id 为 None（复用已有记录时为该记录ID）
+    """
+    # 幂等键可能已在其他进程或重启前使用过
+    if idempotency_key:
+        existing_id = query_reading_by_idempotency_key(openid, idempotency_key)
+        if existing_id:
+            return existing_id, _submitted_response(existing_id, deduplicated=True)
+
+    # 服务正在停止（SIGTERM）时不再接收新任务
+    if reading_pool.closed:
+        return None, make_tarot_err_response('服务正在重启，请稍后重试')
+    # 线程池已满时直接拒绝，避免写入一条永远不会被处理的记录
+    if reading_pool.would_reject():
+        SUBMISSIONS.inc(SUBMIT_REJECTED)
+        return None, make_tarot_err_response('当前解读请求较多，请稍后再试')
+    # 同一用户未完成的解读过多时拒绝，避免单个用户刷满队列
+    if 0 < config.LLM_MAX_PENDING_PER_USER <= reading_pool.count(openid):
+        return None, make_tarot_err_response('您还有未完成的解读，请稍后再提交')
+    # 上游熔断期间快速失败，避免任务堆积在不可用的 AI 服务后面
+    if deepseek_client.breaker.is_open():
+        return None, make_tarot_err_response('AI 服务暂时不可用，请稍后重试')
+
+    ensure_user(openid)
 
     reading = TarotReading()
     reading.openid = openid
     reading.question = question
     reading.cards = json.dumps(cards, ensure_ascii=False)
     reading.spread = spread
+    reading.positions = json.dumps(positions, ensure_ascii=False) if positions else None
+    reading.idempotency_key = idempotency_key or None
     reading.status = 'pending'
     reading.created_at = china_now()
 
     reading_id = insert_tarot_reading(reading)
     if not reading_id:
-        return make_tarot_err_response('创建解读任务失败')
-
-    thread = threading.Thread(
-        target=_process_tarot_reading,
-        args=(app.app_context(), reading_id, question, cards, spread, positions)
+        # 其他进程同时以相同幂等键写入时唯一索引冲突，返回对方创建的记录
+        existing_id = query_reading_by_idempotency_key(openid, idempotency_key) if idempotency_key else None
+        if existing_id:
+            return existing_id, _submitted_response(existing_id, deduplicated=True)
+        return None, make_tarot_err_response('创建解读任务失败')
+    analytics.record_submitted(openid, spread)
+
+    if config.DEEPSEEK_STREAM:
+        # 提前创建流缓冲区，使任务开始前建立的 SSE 连接也能等到输出
+        reading_streams.open(reading_id)
+
+    # 按 openid 公平排队，单个用户大量提交不会挤占其他用户
+    outcome = reading_pool.submit(
+        _process_tarot_reading, app.app_context(), reading_id, question, cards, spread, positions,
+        key=openid, job_id=reading_id
     )
-    thread.daemon = True
-    thread.start()
+    SUBMISSIONS.inc(outcome)
+    if outcome == SUBMIT_REJECTED:
+        transition_tarot_reading(reading_id, 'pending', 'failed', '当前解读请求较多，请稍后再试')
+        analytics.record_finished(spread, 'failed')
+        if config.DEEPSEEK_STREAM:
+            reading_streams.finish(reading_id, 'failed', '当前解读请求较多，请稍后再试')
+        return None, make_tarot_err_response('当前解读请求较多，请稍后再试')
 
-    data = json.dumps({
-        'code': 0,
-        'msg': '已提交解读，请稍候查询结果',
-        'reading_id': reading_id
-    }, ensure_ascii=False)
-    return Response(data, mimetype='application/json')
+    return reading_id, _submitted_response(reading_id)
 
 
 @app.route('/api/tarot/result', methods=['GET'])
 def tarot_result():
     """
     查询塔罗牌解读结果（轮询接口）
-    result 字段为 JSON 对象：{reading_content, 综合分析, 金句, 建议}
+    result 字段为 JSON 对象：{reading_content, 综合分析, 金句, 建议}；解读中只包含已生成完毕的字段
+    可选参数 wait（秒）：解读未结束时挂起请求，直到解读完成/失败或超时（长轮询）
     """
     reading_id = request.args.get('id', type=int)
     if not reading_id:
         return make_tarot_err_response('缺少id参数')
 
-    reading = query_tarot_reading_by_id(reading_id)
-    if not reading:
+    # 先只查状态，解读中的轮询不需要加载 result 大字段
+    state = query_tarot_reading_state(reading_id)
+    if not state:
         return make_tarot_err_response('解读记录不存在')
 
     openid = request.headers.get('X-WX-OPENID', '')
-    if openid and reading.openid != openid:
+    if openid and state.openid != openid:
         return make_tarot_err_response('无权查看此记录')
 
-    if reading.status == 'completed':
-        result_obj = safe_parse_result(reading.result)
-        data = json.dumps({
-            'code': 0,
-            'status': 'completed',
-            'msg': '解读成功',
-            'result': result_obj
-        }, ensure_ascii=False)
-    elif reading.status == 'failed':
-        data = json.dumps({
+    status = state.status
+    wait = min(max(request.args.get('wait', 0, type=float), 0), config.LONG_POLL_MAX_WAIT)
+    if status not in ('completed', 'failed') and wait > 0:
+        # 挂起期间归还数据库连接；pending -> processing 不唤醒客户端，等到解读结束
+        db.session.rollback()
+        deadline = time.monotonic() + wait
+        while status not in ('completed', 'failed'):
+            changed = reading_notifier.wait(reading_id, status, deadline - time.monotonic())
+            if changed is None:
+                # 超时（或任务在其他进程执行）
+                break
+            status = changed
+        # 再查询一次最新状态（完成时同时带回预生成的响应体）
+        state = query_tarot_reading_state(reading_id)
+        if not state:
+            return make_tarot_err_response('解读记录不存在')
+        status = state.status
+
+    # 解读完成时直接返回预生成的响应体，无需再解析和序列化
+    if status == 'completed' and state.result_payload:
+        return Response(state.result_payload, mimetype='application/json')
+
+    # 失败记录以及尚未迁移的旧记录才读取整行
+    reading = None
+    if status in ('completed', 'failed'):
+        reading = query_tarot_reading_by_id(reading_id)
+        if not reading:
+            return make_tarot_err_response('解读记录不存在')
+        status = reading.status
+
+    if status == 'completed':
+        return Response(make_tarot_result_payload(safe_parse_result(reading.result)),
+                        mimetype='application/json')
+    elif status == 'failed':
+        return make_json_response({
             'code': 1,
             'status': 'failed',
             'msg': reading.result or '解读失败',
             'result': {}
-        }, ensure_ascii=False)
+        })
+    partial = safe_parse_result(state.partial_result) if status == 'processing' else {}
+    return make_json_response({
+        'code': 0,
+        'status': status,
+        'msg': '正在解读中，请稍候...',
+        'queue_position': reading_pool.position(reading_id) if status == 'pending' else None,
+        'result': partial
+    })
+
+
+def _sse_event(event, data, event_id=None):
+    """构造一条 SSE 消息"""
+    lines = []
+    if event_id is not None:
+        lines.append('id: {}'.format(event_id))
+    lines.append('event: {}'.format(event))
+    lines.append('data: {}'.format(dumps(data).decode('utf-8')))
+    return '\n'.join(lines) + '\n\n'
+
+
+def _sse_final_event(status, result):
+    """构造解读结束消息：completed 携带完整结果，failed 携带失败原因"""
+    if status == 'completed':
+        return _sse_event('done', {'status': 'completed', 'result': safe_parse_result(result)})
+    return _sse_event('error', {'status': 'failed', 'msg': result or '解读失败'})
+
+
+def _fetch_reading_state(reading_id):
+    """从数据库读取最新状态，并立即归还连接（SSE 连接持续时间较长）"""
+    db.session.expire_all()
+    reading = query_tarot_reading_by_id(reading_id)
+    state = (reading.status, reading.result) if reading else ('failed', '解读记录不存在')
+    db.session.rollback()
+    return state
+
+
+def _poll_reading_events(reading_id, deadline):
+    """定期查询数据库直到解读结束或 deadline，期间按 SSE_KEEPALIVE 发送心跳"""
+    last_ping = time.monotonic()
+    while time.monotonic() < deadline:
+        time.sleep(1)
+        cur_status, cur_result = _fetch_reading_state(reading_id)
+        if cur_status in ('completed', 'failed'):
+            yield _sse_final_event(cur_status, cur_result)
+            return
+        if time.monotonic() - last_ping >= config.SSE_KEEPALIVE:
+            last_ping = time.monotonic()
+            yield ': ping\n\n'
+
+
+@app.route('/api/tarot/stream', methods=['GET'])
+def tarot_stream():
+    """
+    以 Server-Sent Events 推送解读过程（流式接口）
+    - delta 事件：大模型输出的文本片段，id 为已推送的字符偏移量
+    - done / error 事件：解读完成或失败，之后连接关闭
+    断线重连时通过 Last-Event-ID 请求头（或 offset 参数）从上次位置继续
+    """
+    reading_id = request.args.get('id', type=int)
+    if not reading_id:
+        return make_tarot_err_response('缺少id参数')
+
+    reading = query_tarot_reading_by_id(reading_id)
+    if not reading:
+        return make_tarot_err_response('解读记录不存在')
+
+    openid = request.headers.get('X-WX-OPENID', '')
+    if openid and reading.openid != openid:
+        return make_tarot_err_response('无权查看此记录')
+
+    status, result = reading.status, reading.result
+    db.session.rollback()
+
+    offset = request.headers.get('Last-Event-ID', type=int)
+    if offset is None:
+        offset = request.args.get('offset', 0, type=int)
+
+    def generate():
+        yield 'retry: 3000\n\n'
+        if status in ('completed', 'failed'):
+            yield _sse_final_event(status, result)
+            return
+
+        deadline = time.monotonic() + config.SSE_MAX_DURATION
+        stream = reading_streams.get(reading_id)
+        if stream is None:
+            # 任务不在本进程（多实例或服务重启），退化为定期查询数据库
+            yield from _poll_reading_events(reading_id, deadline)
+            return
+
+        pos = max(0, offset)
+        while time.monotonic() < deadline:
+            text, pos, done = stream.read(pos, timeout=config.SSE_KEEPALIVE)
+            if text:
+                yield _sse_event('delta', {'text': text}, pos)
+            elif done:
+                yield _sse_final_event(stream.status, stream.result)
+                return
+            elif stream.closed:
+                # 任务已退回 pending 或被其他线程接管，不会再有输出
+                yield from _poll_reading_events(reading_id, deadline)
+                return
+            else:
+                yield ': ping\n\n'
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
+
+# 历史记录可选字段 -> 需要查询的列
+HISTORY_FIELDS = {
+    'id': ('id',),
+    'question': ('question',),
+    'cards': ('cards',),
+    'spread': ('spread',),
+    'status': ('status',),
+    'excerpt': ('excerpt',),
+    'result': ('status', 'result'),
+    'created_at': ('created_at',),
+}
+# 列表页摘要模式（view=summary）返回的字段
+HISTORY_SUMMARY_FIELDS = ('id', 'question', 'spread', 'status', 'excerpt', 'created_at')
+# 不指定字段时返回的完整记录
+HISTORY_FULL_FIELDS = ('id', 'question', 'cards', 'spread', 'status', 'result', 'created_at')
+
+
+def _parse_history_fields():
+    """
+    解析历史记录的字段选择：fields=id,question,... 或 view=summary，都不传时为完整记录
+    :return: (fields, columns)；字段不合法时返回 None
+    """
+    if request.args.get('fields'):
+        fields = [f.strip() for f in request.args['fields'].split(',') if f.strip()]
+        if not fields or any(f not in HISTORY_FIELDS for f in fields):
+            return None
+    elif request.args.get('view') == 'summary':
+        fields = list(HISTORY_SUMMARY_FIELDS)
     else:
-        data = json.dumps({
-            'code': 0,
-            'status': reading.status,
-            'msg': '正在解读中，请稍候...',
-            'result': {}
-        }, ensure_ascii=False)
+        fields = list(HISTORY_FULL_FIELDS)
+    # 游标分页依赖 id 和 created_at
+    columns = {'id', 'created_at'}
+    for f in fields:
+        columns.update(HISTORY_FIELDS[f])
+    return fields, sorted(columns)
 
-    return Response(data, mimetype='application/json')
+
+def _history_record(reading, fields):
+    """
+    历史记录列表中的单条记录
+    cards 和已完成的 result 在库中都是规范化的 JSON 文本，原样嵌入响应，不逐行解析
+    """
+    record = {}
+    for f in fields:
+        if f == 'cards':
+            record[f] = RawJSON(reading.cards)
+        elif f == 'result':
+            if reading.status != 'completed':
+                record[f] = {}
+            elif reading.result and reading.result.startswith('{'):
+                record[f] = RawJSON(reading.result)
+            else:
+                # 迁移前的旧格式记录
+                record[f] = safe_parse_result(reading.result)
+        elif f == 'excerpt':
+            record[f] = reading.excerpt or ''
+        elif f == 'created_at':
+            # datetime 由序列化层统一格式化
+            record[f] = reading.created_at or ''
+        else:
+            record[f] = getattr(reading, f)
+    return record
 
 
 @app.route('/api/tarot/history', methods=['GET'])
 def tarot_history():
     """
     获取用户的塔罗牌解读历史记录（只返回未被软删除的）
+    传 cursor 参数（第一页传空字符串）时使用游标分页，否则按 page 分页
+    view=summary 只返回列表页需要的字段和摘要；fields 可自选字段；完整解读通过 /api/tarot/result 获取
     """
     openid = request.headers.get('X-WX-OPENID', '')
     if not openid:
         return make_tarot_err_response('无法获取用户身份信息，请通过微信小程序调用')
 
+    page_size = min(max(request.args.get('page_size', 10, type=int), 1), config.HISTORY_MAX_PAGE_SIZE)
+
+    selection = _parse_history_fields()
+    if selection is None:
+        return make_tarot_err_response('fields参数不合法，可选：{}'.format(','.join(HISTORY_FIELDS)))
+    fields, columns = selection
+
+    if 'cursor' in request.args:
+        cursor = None
+        if request.args['cursor']:
+            cursor = decode_history_cursor(request.args['cursor'])
+            if cursor is None:
+                return make_tarot_err_response('cursor参数不合法')
+        with_total = request.args.get('with_total', 0, type=int) == 1
+
+        page = query_readings_by_cursor(openid, cursor, page_size, with_total, columns)
+        if page is None:
+            return make_tarot_err_response('查询历史记录失败')
+        readings, next_cursor, total = page
+
+        data = {
+            'list': [_history_record(reading, fields) for reading in readings],
+            'next_cursor': next_cursor or '',
+            'has_more': next_cursor is not None,
+            'page_size': page_size
+        }
+        if with_total:
+            data['total'] = total
+        return make_succ_response(data)
+
     page = request.args.get('page', 1, type=int)
-    page_size = request.args.get('page_size', 10, type=int)
 
-    pagination = query_readings_by_openid(openid, page, page_size)
+    pagination = query_readings_by_openid(openid, page, page_size, columns)
     if pagination is None:
         return make_tarot_err_response('查询历史记录失败')
 
-    records = []
-    for reading in pagination.items:
-        if reading.status == 'completed':
-            result_obj = safe_parse_result(reading.result)
-        else:
-            result_obj = {}
-        records.append({
-            'id': reading.id,
-            'question': reading.question,
-            'cards': json.loads(reading.cards),
-            'spread': reading.spread,
-            'status': reading.status,
-            'result': result_obj,
-            'created_at': reading.created_at.strftime('%Y-%m-%d %H:%M:%S') if reading.created_at else ''
-        })
-
     return make_succ_response({
-        'list': records,
+        'list': [_history_record(reading, fields) for reading in pagination.items],
         'total': pagination.total,
         'page': page,
         'page_size': page_size
@@ -217,7 +620,7 @@ def tarot_history_delete():
 @app.route('/api/tarot/history/delete_all', methods=['POST'])
 def tarot_history_delete_all():
     """
-    删除用户所有塔罗牌解读历史记录（软删除，数据库保留）
+    删除用户所有塔罗牌解读历史记录（分批软删除；已删除的记录由归档任务移到归档表）
     """
     openid = request.headers.get('X-WX-OPENID', '')
     if not openid:
@@ -241,28 +644,63 @@ def tarot_image():
     if not name:
         return make_tarot_err_response('缺少图片名称参数 name')
 
-    # 防止路径遍历，只允许字母数字、中文、下划线、横线、点
-    if not re.match(r'^[\w\u4e00-\u9fff\-\.]+$', name):
+    # 防止路径遍历，若无扩展名则补 .png
+    name = normalize_image_name(name)
+    if not name:
         return make_tarot_err_response('图片名称格式不合法')
 
-    # 若无扩展名则补 .png
-    if '.' not in name:
-        name = name + '.png'
+    # 从内存中的图片清单解析，不再逐次请求对象存储
+    return make_succ_response({'url': card_images.resolve(name)})
 
-    base_url = config.STORAGE_BASE_URL.rstrip('/')
-    image_url = f"{base_url}/{name}"
-    default_url = f"{base_url}/{config.STORAGE_DEFAULT_IMAGE}"
 
-    try:
-        resp = requests.head(image_url, timeout=3)
-        if resp.status_code == 200:
-            url = image_url
-        else:
-            url = default_url
-    except Exception:
-        url = default_url
+@app.route('/api/tarot/images', methods=['POST'])
+def tarot_images():
+    """
+    批量获取塔罗牌图片 URL（一次请求解析一个牌阵或整副牌）
+    请求体: { "names": ["10命运之轮", "the_fool"] }
+    校验规则与默认图回退同 /api/tarot/image，格式不合法的名称放入 invalid
+    """
+    params = request.get_json()
+    if not params:
+        return make_tarot_err_response('请求参数不能为空')
+
+    names = params.get('names')
+    if not names or not isinstance(names, list):
+        return make_tarot_err_response('缺少图片名称列表参数 names')
+    if len(names) > config.STORAGE_BATCH_LIMIT:
+        return make_tarot_err_response('图片数量不能超过 {}'.format(config.STORAGE_BATCH_LIMIT))
+
+    urls = {}
+    invalid = []
+    for raw in names:
+        name = normalize_image_name(raw) if isinstance(raw, str) else None
+        if not name:
+            invalid.append(raw)
+            continue
+        urls[raw] = card_images.resolve(name)
+
+    return make_succ_response({'urls': urls, 'invalid': invalid})
+
 
-    return make_succ_response({'url': url})
+@app.route('/api/tarot/images/manifest', methods=['GET'])
+def tarot_images_manifest():
+    """
+    获取整副牌的图片清单（带强 ETag，客户端可用 If-None-Match 校验，未变化时返回 304）
+    清单尚未加载时返回 503，不返回不完整的清单
+    """
+    doc, etag = card_images.manifest()
+    if doc is None:
+        return make_json_response({'code': -1, 'errorMsg': '图片清单尚未加载，请稍后重试'}, status=503)
+    headers = {
+        'ETag': '"{}"'.format(etag),
+        'Cache-Control': 'public, max-age={}'.format(config.STORAGE_MANIFEST_MAX_AGE),
+    }
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    resp = make_succ_response(doc)
+    resp.headers.extend(headers)
+    return resp
 
 
 # ============ 用户相关接口 ============
@@ -284,7 +722,7 @@ def user_info():
         'openid': user.openid,
         'nickname': user.nickname or '',
         'avatar_url': user.avatar_url or '',
-        'created_at': user.created_at.strftime('%Y-%m-%d %H:%M:%S') if user.created_at else ''
+        'created_at': user.created_at or ''
     })
 
 
@@ -302,7 +740,7 @@ def user_update():
     if not params:
         return make_tarot_err_response('请求参数不能为空')
 
-    get_or_create_user(openid)
+    ensure_user(openid)
 
     nickname = params.get('nickname')
     avatar_url = params.get('avatar_url')
@@ -314,15 +752,209 @@ def user_update():
         return make_tarot_err_response(msg)
 
 
+# ============ 服务启停 ============
+
+def recover_pending_readings():
+    """
+    把仍处于 pending 状态的记录重新放回线程池
+    覆盖的情况：上一个实例停止时尚未开始、或执行超时被退回 pending 的任务；
+    以及执行租约（PROCESSING_LEASE）已过期的 processing 记录（进程被强制杀死，没来得及退回 pending）
+    已在本进程线程池中的记录跳过；其他进程重复入队是安全的：任务开始时 pending -> processing 是
+    compare-and-set，只有一个线程能领取
+    :return: 重新入队的记录数
+    """
+    now = china_now()
+    with app.app_context():
+        if config.PROCESSING_LEASE > 0:
+            reclaimed = reclaim_stale_readings(now - timedelta(seconds=config.PROCESSING_LEASE))
+            if reclaimed:
+                logger.warning("执行租约过期的 processing 解读任务 {} 条已退回 pending".format(reclaimed))
+        readings = query_pending_readings(
+            now - timedelta(seconds=config.RECOVERY_MAX_AGE),
+            now - timedelta(seconds=config.RECOVERY_MIN_AGE)
+        )
+    recovered = 0
+    for reading in readings:
+        if reading_pool.contains(reading.id):
+            # 仍在本进程排队或执行中，重复入队只会占用队列名额
+            continue
+        try:
+            cards = json.loads(reading.cards)
+            positions = json.loads(reading.positions) if reading.positions else []
+        except (json.JSONDecodeError, TypeError):
+            with app.app_context():
+                if transition_tarot_reading(reading.id, 'pending', 'failed', '解读过程发生异常'):
+                    analytics.record_finished(reading.spread, 'failed')
+            continue
+        outcome = reading_pool.submit(
+            _process_tarot_reading, app.app_context(), reading.id, reading.question, cards, reading.spread, positions,
+            key=reading.openid, job_id=reading.id
+        )
+        if outcome == SUBMIT_REJECTED:
+            # 线程池已满，剩余记录留到下一轮
+            break
+        recovered += 1
+    if recovered:
+        logger.info("已重新入队 pending 解读任务 {} 条".format(recovered))
+    return recovered
+
+
+def _recovery_loop():
+    while not reading_pool.closed:
+        try:
+            recover_pending_readings()
+        except Exception as e:
+            logger.error("恢复 pending 解读任务失败: {}".format(e))
+        if config.RECOVERY_INTERVAL <= 0:
+            return
+        time.sleep(config.RECOVERY_INTERVAL)
+
+
+_recovery_pid = None
+_recovery_lock = threading.Lock()
+
+
+def start_recovery():
+    """启动 pending 任务恢复线程（每个进程一次）"""
+    global _recovery_pid
+    with _recovery_lock:
+        if _recovery_pid == os.getpid():
+            return
+        _recovery_pid = os.getpid()
+    thread = threading.Thread(target=_recovery_loop, name='reading-recovery')
+    thread.daemon = True
+    thread.start()
+
+
+_drain_lock = threading.Lock()
+_drain_result = None
+
+
+def start_drain():
+    """收到 SIGTERM 时立即在后台开始排空，不必等 gunicorn 关闭完进行中的请求（SSE、长轮询）"""
+    thread = threading.Thread(target=drain_readings, name='reading-drain')
+    thread.daemon = True
+    thread.start()
+
+
+def drain_readings(timeout=None):
+    """
+    优雅停止（SIGTERM 时调用）：
+    - 不再接收新的解读请求
+    - 尚未开始的任务保持 pending，由下一个实例恢复
+    - 等待执行中的任务最多 timeout 秒，仍未完成的退回 pending
+    只执行一次；重复调用时等待第一次排空结束并返回其结果
+    :return: (未开始的任务数, 退回 pending 的任务数)
+    """
+    global _drain_result
+    with _drain_lock:
+        if _drain_result is None:
+            _drain_result = _drain(timeout)
+        return _drain_result
+
+
+def _drain(timeout):
+    if timeout is None:
+        timeout = config.SHUTDOWN_GRACE_PERIOD
+    stop_archiver()
+    not_started, unfinished = reading_pool.drain(timeout)
+    # 任务参数为 (app_context, reading_id, ...)
+    with app.app_context():
+        for args in unfinished:
+            transition_tarot_reading(args[1], 'processing', 'pending')
+    # 这些任务将由其他实例执行，关闭本进程的流缓冲区
+    for args in not_started + unfinished:
+        reading_streams.discard(args[1])
+    analytics.stop()
+    logger.info("解读线程池已停止, 未开始={}, 退回 pending={}".format(len(not_started), len(unfinished)))
+    return len(not_started), len(unfinished)
+
+
+@app.route('/api/ready', methods=['GET'])
+def ready():
+    """
+    就绪探针：本进程完成预热后返回 200，否则返回 503
+    同时返回预热耗时和从导入到就绪的耗时
+    预热失败（数据库或图片清单暂时不可用）时每次探测都重新预热，恢复后即返回就绪
+    """
+    state = readiness()
+    if not state.get('ready') and state.get('pid') is not None:
+        warmup()
+        state = readiness()
+    state.pop('pid', None)
+    if state.get('ready'):
+        return make_succ_response(state)
+    return make_json_response({'code': -1, 'data': state}, status=503)
+
+
 # ============ 管理/调试接口 ============
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Prometheus 指标（文本格式）：接口耗时、DeepSeek 耗时与 token、解析 fallback、排队等待、任务状态
+    """
+    if not config.METRICS_ENABLED:
+        return make_err_response('指标未开启')
+    return Response(registry.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/api/admin/workers', methods=['GET'])
+def admin_workers():
+    """
+    管理接口：查看解读线程池的队列深度、工作线程利用率、大模型限流状态与重复提交合并情况
+    """
+    stats = reading_pool.stats()
+    stats['deepseek_circuit'] = deepseek_client.breaker.state
+    stats['deepseek_limiter'] = deepseek_client.limiter.stats()
+    stats['submission_dedupe'] = submission_deduper.stats()
+    return make_succ_response(stats)
+
+
+@app.route('/api/admin/cache', methods=['GET'])
+def admin_cache():
+    """
+    管理接口：查看解读结果缓存的命中情况
+    """
+    return make_succ_response(interpretation_cache.stats())
+
+
+@app.route('/api/admin/images', methods=['GET'])
+def admin_images():
+    """
+    管理接口：查看图片清单的加载状态与命中情况
+    """
+    return make_succ_response(card_images.stats())
+
+
+# 管理端记录列表中 result 的预览长度（字符）
+ADMIN_RESULT_PREVIEW = 200
+
+
 @app.route('/api/admin/readings', methods=['GET'])
 def admin_readings():
     """
-    管理接口：查看所有塔罗解读记录（上线后应删除或加权限）
+    管理接口：按 id 倒序分页查看塔罗解读记录（上线后应删除或加权限）
+    参数 cursor（上一页返回的 next_cursor，首页不传）、page_size、openid（可选，只看某个用户）
+    按主键游标分页，翻页耗时与页码无关；result 只在数据库中截取前 ADMIN_RESULT_PREVIEW 个字符
     """
+    page_size = min(max(request.args.get('page_size', 50, type=int), 1), config.ADMIN_MAX_PAGE_SIZE)
+    cursor = request.args.get('cursor', type=int)
+    openid = request.args.get('openid')
     try:
-        readings = TarotReading.query.order_by(TarotReading.created_at.desc()).limit(50).all()
+        # 多取一个字符用于判断是否被截断
+        preview = func.substr(TarotReading.result, 1, ADMIN_RESULT_PREVIEW + 1).label('result')
+        query = db.session.query(
+            TarotReading.id, TarotReading.openid, TarotReading.question, TarotReading.cards, TarotReading.spread,
+            TarotReading.status, preview, TarotReading.created_at
+        )
+        if openid:
+            query = query.filter(TarotReading.openid == openid)
+        if cursor:
+            query = query.filter(TarotReading.id < cursor)
+        readings = query.order_by(TarotReading.id.desc()).limit(page_size + 1).all()
+        has_more = len(readings) > page_size
+        readings = readings[:page_size]
         records = []
         for r in readings:
             records.append({
@@ -332,14 +964,84 @@ def admin_readings():
                 'cards': r.cards,
                 'spread': r.spread,
                 'status': r.status,
-                'result': r.result[:200] + '...' if r.result and len(r.result) > 200 else r.result,
-                'created_at': r.created_at.strftime('%Y-%m-%d %H:%M:%S') if r.created_at else ''
+                'result': r.result[:ADMIN_RESULT_PREVIEW] + '...' if r.result and len(r.result) > ADMIN_RESULT_PREVIEW
+                else r.result,
+                'created_at': r.created_at or ''
             })
-        return make_succ_response({'total': len(records), 'records': records})
+        return make_succ_response({
+            'total': len(records),
+            'records': records,
+            'next_cursor': records[-1]['id'] if has_more else None,
+            'has_more': has_more
+        })
     except Exception as e:
         return make_err_response('查询失败: {}'.format(str(e)))
 
 
+@app.route('/api/admin/analytics', methods=['GET'])
+def admin_analytics():
+    """
+    管理接口：统计看板（最近 days 天的每日提交/完成/失败数、活跃用户数、热门牌阵）
+    只读取统计汇总表；最近 ANALYTICS_FLUSH_INTERVAL 秒内的变化可能尚未写入
+    """
+    days = min(max(request.args.get('days', 7, type=int), 1), 366)
+    try:
+        data = query_dashboard(days)
+    except Exception as e:
+        return make_err_response('查询失败: {}'.format(str(e)))
+    data['recorder'] = analytics.stats()
+    return make_succ_response(data)
+
+
+@app.route('/api/admin/dbpool', methods=['GET'])
+def admin_dbpool():
+    """
+    管理接口：查看数据库连接池状态（已借出、溢出、等待时间等）
+    """
+    return make_succ_response(describe_pool(db.engine))
+
+
+def _admin_token_valid():
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(config.PROFILE_ADMIN_TOKEN) and hmac.compare_digest(token, config.PROFILE_ADMIN_TOKEN)
+
+
+@app.route('/api/admin/profile', methods=['GET'])
+def admin_profile():
+    """
+    管理接口：导出请求采样分析结果（需请求头 X-Admin-Token）
+    参数 route（路由模板，可选）、format（pstats / raw / collapsed）、limit、sort；
+    不带 format 时返回各路由的采样次数
+    """
+    if not _admin_token_valid():
+        return make_json_response({'code': -1, 'errorMsg': '无权访问'}, status=403)
+    fmt = request.args.get('format')
+    if not fmt:
+        return make_succ_response(request_profiler.summary())
+    if fmt not in ('pstats', 'raw', 'collapsed'):
+        return make_err_response('format 参数不正确')
+    body, mimetype = request_profiler.dump(
+        route=request.args.get('route') or None,
+        fmt=fmt,
+        limit=request.args.get('limit', 50, type=int),
+        sort=request.args.get('sort', 'cumulative')
+    )
+    if body is None:
+        return make_err_response(mimetype)
+    return Response(body, mimetype=mimetype)
+
+
+@app.route('/api/admin/profile/reset', methods=['POST'])
+def admin_profile_reset():
+    """
+    管理接口：清空采样分析结果（需请求头 X-Admin-Token）
+    """
+    if not _admin_token_valid():
+        return make_json_response({'code': -1, 'errorMsg': '无权访问'}, status=403)
+    request_profiler.reset()
+    return make_succ_empty_response()
+
+
 @app.route('/api/dbtest', methods=['GET'])
 def db_test():
     """
@@ -368,24 +1070,37 @@ def db_test():
         reading.status = 'completed'
         reading.result = '这是一段测试解读内容，包含中文。'
         reading.created_at = china_now()
-        insert_tarot_reading(reading)
+        if insert_tarot_reading(reading):
+            # 与正常提交一样计入统计汇总，汇总与记录表保持一致
+            analytics.record_submitted(reading.openid, reading.spread)
+            analytics.record_finished(reading.spread, reading.status)
         info['db_write'] = '成功'
     except Exception as e:
         info['db_write'] = '失败'
         info['db_write_error'] = str(e)
 
     try:
-        count = TarotReading.query.count()
-        info['total_readings'] = count
+        # 读取统计汇总，不对 tarot_readings 做全表 count
+        info['total_readings'] = query_total_submitted()
     except Exception as e:
         info['db_read_error'] = str(e)
 
     return make_succ_response(info)
 
 
+def init_worker():
+    """工作进程启动时调用：预热连接，恢复未执行的解读任务，并启动归档和统计汇总线程"""
+    warmup()
+    start_recovery()
+    start_archiver()
+    analytics.start()
+
+
 @app.before_first_request
-def init_db():
+def ensure_worker_ready():
     """
-    首次请求时自动创建数据库表
+    未经 gunicorn 启动钩子（如本地 python run.py）时，在首次请求前完成预热
+    建表和迁移不在请求中执行，见 bootstrap() 与 python run.py migrate
     """
-    db.create_all()
+    if not readiness().get('ready'):
+        init_worker()
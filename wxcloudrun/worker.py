@@ -0,0 +1,366 @@
+import logging
+import os
+import threading
+import time
+from collections import deque, OrderedDict
+
+logger = logging.getLogger('log')
+
+# 队列满时的处理策略
+# reject: 直接拒绝新任务（快速失败）
+# pending: 任务进入溢出队列，记录保持 pending 状态，待有空闲容量时再取出执行
+OVERFLOW_REJECT = 'reject'
+OVERFLOW_PENDING = 'pending'
+
+# submit() 的返回值
+SUBMIT_QUEUED = 'queued'
+SUBMIT_DEFERRED = 'deferred'
+SUBMIT_REJECTED = 'rejected'
+
+
+class _Job(object):
+    __slots__ = ('fn', 'args', 'key', 'job_id', 'enqueued_at')
+
+    def __init__(self, fn, args, key=None, job_id=None):
+        self.fn = fn
+        self.args = args
+        self.key = key
+        self.job_id = job_id
+        self.enqueued_at = time.monotonic()
+
+
+class _FairQueue(object):
+    """
+    按 key（用户 openid）轮转出队的等待队列
+    每个 key 各自先进先出，不同 key 之间轮流取一个，单个用户提交再多任务也不会让其他用户一直排在后面
+    """
+
+    def __init__(self):
+        self._lanes = OrderedDict()
+        self._size = 0
+
+    def append(self, job):
+        lane = self._lanes.get(job.key)
+        if lane is None:
+            lane = self._lanes[job.key] = deque()
+        lane.append(job)
+        self._size += 1
+
+    def popleft(self):
+        key, lane = next(iter(self._lanes.items()))
+        job = lane.popleft()
+        if lane:
+            # 本轮已取过，移到队尾
+            self._lanes.move_to_end(key)
+        else:
+            del self._lanes[key]
+        self._size -= 1
+        return job
+
+    def clear(self):
+        self._lanes.clear()
+        self._size = 0
+
+    def count(self, key):
+        lane = self._lanes.get(key)
+        return len(lane) if lane else 0
+
+    def position(self, job_id):
+        """
+        按当前轮转顺序，排在该任务前面的任务数；不在队列中返回 None
+        第 i 个任务在第 i 轮出队，之前每个 key 最多出队 i 个，轮转顺序在它前面的 key 再多出一个
+        """
+        for order, (key, lane) in enumerate(self._lanes.items()):
+            for index, job in enumerate(lane):
+                if job.job_id != job_id:
+                    continue
+                ahead = index
+                for other_order, other in enumerate(self._lanes.values()):
+                    if other_order == order:
+                        continue
+                    ahead += min(len(other), index + (1 if other_order < order else 0))
+                return ahead
+        return None
+
+    @property
+    def keys(self):
+        return len(self._lanes)
+
+    def __iter__(self):
+        for lane in self._lanes.values():
+            for job in lane:
+                yield job
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return self._size > 0
+
+
+class ReadingWorkerPool(object):
+    """
+    有界的解读任务线程池
+    - 最多 max_workers 个工作线程，按需启动
+    - 等待队列最多 queue_size 个任务，按提交时的 key（用户 openid）轮转出队
+    - 队列满时按 overflow_policy 拒绝或进入溢出队列（最多 backlog_size 个）
+    工作线程在首次提交任务时才启动，并在 fork 后的子进程中自动重建。
+    """
+
+    def __init__(self, max_workers, queue_size, overflow_policy=OVERFLOW_REJECT, backlog_size=0,
+                 name='reading-worker', on_wait=None):
+        if overflow_policy not in (OVERFLOW_REJECT, OVERFLOW_PENDING):
+            raise ValueError("未知的溢出策略: {}".format(overflow_policy))
+        self.max_workers = max(1, int(max_workers))
+        self.queue_size = max(0, int(queue_size))
+        self.overflow_policy = overflow_policy
+        self.backlog_size = max(0, int(backlog_size))
+        self.name = name
+        # 任务开始执行时回调 on_wait(等待秒数)，用于上报指标
+        self.on_wait = on_wait
+
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._reset()
+
+    def _reset(self):
+        """初始化（或在 fork 后重建）运行时状态"""
+        self._pid = os.getpid()
+        self._queue = _FairQueue()
+        self._backlog = deque()
+        self._threads = []
+        self._running = set()
+        # job_id -> 排队、溢出和执行中的任务数
+        self._job_ids = {}
+        self._idle = 0
+        self._busy = 0
+        self._shutdown = False
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._deferred = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            # fork 出的子进程不会继承父进程的线程，丢弃旧状态重新开始
+            self._lock = threading.Lock()
+            self._cond = threading.Condition(self._lock)
+            self._reset()
+
+    @property
+    def closed(self):
+        """是否已停止接收新任务（shutdown/drain 之后）"""
+        self._check_pid()
+        return self._shutdown
+
+    def would_reject(self):
+        """当前提交任务是否会被拒绝（用于在写库前快速失败）"""
+        self._check_pid()
+        with self._lock:
+            if self._shutdown:
+                return True
+            return self._is_full_locked() and not self._backlog_has_room_locked()
+
+    def _is_full_locked(self):
+        # 可立即执行的空位 = 尚未忙碌的工作线程数（含未启动的），其余任务占用等待队列
+        return len(self._queue) >= self.queue_size + self.max_workers - self._busy
+
+    def _track_locked(self, job, delta):
+        if job.job_id is None:
+            return
+        count = self._job_ids.get(job.job_id, 0) + delta
+        if count > 0:
+            self._job_ids[job.job_id] = count
+        else:
+            self._job_ids.pop(job.job_id, None)
+
+    def _backlog_has_room_locked(self):
+        if self.overflow_policy != OVERFLOW_PENDING:
+            return False
+        return self.backlog_size == 0 or len(self._backlog) < self.backlog_size
+
+    def submit(self, fn, *args, key=None, job_id=None):
+        """
+        提交任务
+        :param key: 公平排队的分组（用户 openid），同一 key 的任务按提交顺序执行
+        :param job_id: 任务标识（解读记录ID），用于查询排队位置
+        :return: SUBMIT_QUEUED / SUBMIT_DEFERRED / SUBMIT_REJECTED
+        """
+        self._check_pid()
+        job = _Job(fn, args, key, job_id)
+        with self._cond:
+            if self._shutdown:
+                self._rejected += 1
+                return SUBMIT_REJECTED
+            if not self._is_full_locked():
+                self._queue.append(job)
+                outcome = SUBMIT_QUEUED
+            elif self._backlog_has_room_locked():
+                self._backlog.append(job)
+                self._deferred += 1
+                outcome = SUBMIT_DEFERRED
+            else:
+                self._rejected += 1
+                return SUBMIT_REJECTED
+            self._submitted += 1
+            self._track_locked(job, 1)
+            self._maybe_start_worker_locked()
+            self._cond.notify()
+            return outcome
+
+    def _maybe_start_worker_locked(self):
+        if len(self._queue) <= self._idle or len(self._threads) >= self.max_workers:
+            return
+        thread = threading.Thread(
+            target=self._worker_loop,
+            name='{}-{}'.format(self.name, len(self._threads))
+        )
+        thread.daemon = True
+        self._threads.append(thread)
+        thread.start()
+
+    def _next_job_locked(self):
+        if self._queue:
+            job = self._queue.popleft()
+        elif self._backlog:
+            job = self._backlog.popleft()
+        else:
+            return None
+        # 等待队列腾出位置后，把溢出队列中的任务补进来
+        while self._backlog and len(self._queue) < self.queue_size:
+            self._queue.append(self._backlog.popleft())
+        return job
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                self._idle += 1
+                job = self._next_job_locked()
+                while job is None and not self._shutdown:
+                    self._cond.wait()
+                    job = self._next_job_locked()
+                self._idle -= 1
+                if job is None:
+                    return
+                self._busy += 1
+                self._running.add(job)
+                wait = time.monotonic() - job.enqueued_at
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+            if self.on_wait is not None:
+                self.on_wait(wait)
+
+            ok = True
+            try:
+                job.fn(*job.args)
+            except Exception as e:
+                ok = False
+                logger.error("解读任务执行异常: {}".format(e))
+
+            with self._cond:
+                self._busy -= 1
+                self._running.discard(job)
+                self._track_locked(job, -1)
+                if ok:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+
+    def shutdown(self, wait=True, timeout=None):
+        """停止接收新任务；wait=True 时等待已排队任务执行完毕"""
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+            threads = list(self._threads)
+        if wait:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            for thread in threads:
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                thread.join(remaining)
+
+    def position(self, job_id):
+        """
+        任务的排队位置（前面还有多少个任务）
+        :return: 0 表示下一个执行；已开始执行或不在本进程中时返回 None
+        """
+        self._check_pid()
+        with self._lock:
+            ahead = self._queue.position(job_id)
+            if ahead is not None:
+                return ahead
+            for index, job in enumerate(self._backlog):
+                if job.job_id == job_id:
+                    return len(self._queue) + index
+            return None
+
+    def contains(self, job_id):
+        """该任务是否已在本进程中排队、溢出或执行中"""
+        self._check_pid()
+        with self._lock:
+            return job_id in self._job_ids
+
+    def running(self, job_id):
+        """本进程中正在执行该任务的工作线程数"""
+        self._check_pid()
+        with self._lock:
+            return sum(1 for job in self._running if job.job_id == job_id)
+
+    def count(self, key):
+        """某个 key 已提交、尚未完成的任务数（排队 + 溢出 + 执行中）"""
+        self._check_pid()
+        with self._lock:
+            return (self._queue.count(key)
+                    + sum(1 for job in self._backlog if job.key == key)
+                    + sum(1 for job in self._running if job.key == key))
+
+    def drain(self, timeout=None):
+        """
+        优雅停止：不再接收新任务，丢弃尚未开始的任务，等待执行中的任务最多 timeout 秒
+        :return: (未开始任务的参数列表, 超时后仍在执行的任务参数列表)
+        """
+        self._check_pid()
+        with self._cond:
+            self._shutdown = True
+            not_started = [job.args for job in self._queue] + [job.args for job in self._backlog]
+            for job in list(self._queue) + list(self._backlog):
+                self._track_locked(job, -1)
+            self._queue.clear()
+            self._backlog.clear()
+            self._cond.notify_all()
+            threads = list(self._threads)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in threads:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            thread.join(remaining)
+        with self._lock:
+            unfinished = [job.args for job in self._running]
+        return not_started, unfinished
+
+    def stats(self):
+        """返回线程池运行指标，便于根据真实数据确定实例规格"""
+        self._check_pid()
+        with self._lock:
+            started = self._completed + self._failed + self._busy
+            return {
+                'max_workers': self.max_workers,
+                'workers': len(self._threads),
+                'busy_workers': self._busy,
+                'utilisation': round(self._busy / float(self.max_workers), 4),
+                'queue_depth': len(self._queue),
+                'queue_size': self.queue_size,
+                'queue_keys': self._queue.keys,
+                'backlog_depth': len(self._backlog),
+                'backlog_size': self.backlog_size,
+                'overflow_policy': self.overflow_policy,
+                'closed': self._shutdown,
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'failed': self._failed,
+                'deferred': self._deferred,
+                'rejected': self._rejected,
+                'avg_wait_ms': round(self._wait_total * 1000 / started, 2) if started else 0.0,
+                'max_wait_ms': round(self._wait_max * 1000, 2),
+            }